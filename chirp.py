@@ -1,37 +1,22 @@
 #!/usr/bin/python3
 
 import commpy
-from scipy import signal
+import dft
+import fir
+import sysid
 import numpy as np
 import matplotlib.pyplot as plt
 
-def zoom_fft(fft, N, Fs, threshold=0.5):
-    freq = np.fft.fftfreq(N, d=1/Fs)
-
-    fft = fft[:N//2]
-    freq = freq[:N//2]
+# Zoomed spectrum of the band above threshold, m bins by the chirp-z
+# transform instead of the Fs/N grid of a plain FFT
+def zoom_fft(sig, Fs, threshold=0.5, m=1024):
+    fft, freq = dft.zoom(sig, Fs, threshold, m=m, margin=2)
 
     magnitude = abs(fft)
     # In power dB
     power_db = 20 * np.log10(magnitude)
 
-    fft_indices = np.argwhere(magnitude > threshold).flatten()
-    all_indices = False
-    if len(fft_indices) == 0:
-        all_indices = True
-        fft_indices = np.argwhere(magnitude).flatten()
-
-    if not all_indices:
-        min_freq = np.min(freq[fft_indices])
-        max_freq = np.max(freq[fft_indices])
-        d = (max_freq - min_freq) * 2
-        min_freq -= d
-        max_freq += d
-        min_idx = (np.abs(freq - min_freq)).argmin()
-        max_idx = (np.abs(freq - max_freq)).argmin()
-        fft_indices = np.arange(min_idx, max_idx)
-
-    return fft_indices, freq, magnitude, power_db
+    return fft, freq, magnitude, power_db
 
 
 
@@ -39,15 +24,17 @@ Fs = 512
 N = Fs
 G = 1
 
-bandpass = signal.firwin(numtaps=255, cutoff=[35, 45], scale=True, pass_zero=False, fs=Fs)
-bandpass *= G
+bandpass = fir.firwin_bank(numtaps=255, cutoffs=[35, 45], fs=Fs)[0]
+bandpass = bandpass * G
 
-n = len(bandpass)
 f = 40
-w = 2*np.pi*f/Fs
-zeta = np.array([np.exp(-1j*w*k) for k in np.arange(0, n)])
-zeta *= bandpass
-print("Bandpass G %.3f for %.3f Hz" % (np.abs(np.sum(zeta)), f))
+freqs, gain, phase, gdelay = fir.freq_response(bandpass, [f], Fs)
+print("Bandpass G %.3f for %.3f Hz, group delay %.1f samples" %
+      (gain[0], f, gdelay[0]))
+passband = fir.band_gain(bandpass, (35, 45), Fs)
+stopband = max(fir.band_gain(bandpass, (0, 25), Fs)[1],
+               fir.band_gain(bandpass, (55, Fs/2), Fs)[1])
+print("Passband G %.3f..%.3f, stopband G < %.5f" % (*passband, stopband))
 
 
 def f(t, f0, f1, t1):
@@ -55,26 +42,41 @@ def f(t, f0, f1, t1):
 
 t = np.linspace(0, 1, N, endpoint=False)
 chirp = np.cos(2*np.pi*f(t, 0, 70, 1)*t)
-chirp_response = np.convolve(chirp, bandpass)[:N]
-
-c_fft = np.fft.fft(chirp, N)
-cr_fft = np.fft.fft(chirp_response, N)
-fft = cr_fft / c_fft
 
-fft_indices, freq, magnitude, power_db = zoom_fft(fft, N, Fs)
+# Periodic excitation, the first period only fills the filter, the
+# response gets some measurement noise
+frames = 16
+chirp = np.tile(chirp, frames + 1)
+chirp_response = fir.FIRFilter(bandpass).process(chirp)
+chirp_response += 1e-3 * np.random.default_rng(0).standard_normal(len(chirp))
+
+# Whole periods with a rectangular window are leakage free
+estimate = sysid.SysID(nperseg=N, noverlap=0, window="boxcar", fs=Fs)
+estimate.update(chirp[N:], chirp_response[N:])
+coherence = estimate.coherence()
+print("Coherence 35-45 Hz >= %.4f over %d frames" %
+      (np.min(coherence[(estimate.freqs >= 35) & (estimate.freqs <= 45)]),
+       estimate.nsegs))
+
+# Impulse response of the estimate fits in N samples, its chirp-z
+# transform interpolates H1 at any resolution. Above the chirp there is
+# no excitation, H1 is noise over noise there
+H1 = np.where(coherence > 0.9, estimate.h1(), 0)
+impulse_response = np.fft.irfft(H1, N)
+fft, freq, magnitude, power_db = zoom_fft(impulse_response, Fs)
 
 fig, ax = plt.subplots(2,1)
 
 ax[0].plot(bandpass)
 
-ax[1].plot(freq[fft_indices], power_db[fft_indices], 'b')
+ax[1].plot(freq, power_db, 'b')
 ax[1].set_xlabel("Frequency")
 ax[1].set_ylabel("Power dB", color='b')
 ax[1].tick_params(axis='y', labelcolor='b')
 
 ax1_twin = ax[1].twinx()
-ax1_twin.plot(freq[fft_indices], np.rad2deg(np.angle(fft[fft_indices])), 'r')
-#ax1_twin.plot(freq[fft_indices], power_db[fft_indices], 'r')
+ax1_twin.plot(freq, np.rad2deg(np.angle(fft)), 'r')
+#ax1_twin.plot(freq, power_db, 'r')
 ax1_twin.set_ylabel("Phase", color='r')
 ax1_twin.tick_params(axis='y', labelcolor='r')
 
@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+
+#
+# DFT engine with the same call signature as qpsk.sft(), picking the
+# algorithm by what is asked for:
+#
+#   full spectrum    - FFT (numpy pocketfft, radix 2/3/4/5 and generic
+#                      mixed radix, Bluestein for large primes)
+#   a few bins       - one product with cached twiddle rows, O(N) per
+#                      bin, bins may be fractional
+#   zoomed band      - chirp-z transform, M bins over [f_lo, f_hi)
+#
+# peaks() is a spectrum analyzer returning interpolated local peaks,
+# zoom() finds the band where the spectrum is above a threshold and
+# resolves it with the chirp-z transform at any resolution.
+#
+# Twiddle rows of the bins and chirp-z transforms are cached per
+# signal length, so repeated calls on equally sized frames are cheap.
+#
+# Running this file benchmarks the engines against the old sft().
+#
+
+import collections, functools, sys, time
+import numpy as np
+from scipy import signal
+
+# Bins computed with twiddle rows up to this many elements per call,
+# larger ones build the twiddles chunk by chunk without caching
+DFT_BINS_MAX_TWIDDLES = 2**20
+# Twiddle rows are cached per (length, bin) up to this many bytes
+DFT_TWIDDLE_CACHE_BYTES = 2**24
+
+# The products with cached twiddles beat a full FFT up to ~log2(N)/2 bins
+def bins_are_cheaper(n, nbins):
+    return (nbins <= max(1, int(np.log2(max(n, 2))) // 2) and
+            nbins * n <= DFT_BINS_MAX_TWIDDLES)
+
+def bins_twiddles(n, bins, lo=0, hi=None):
+    w = 2 * np.pi * np.asarray(bins, dtype=float) / n
+    return np.exp(-1j * np.multiply.outer(w, np.arange(lo, hi or n)))
+
+# Least recently used rows are dropped beyond max_bytes, so calls with
+# different bins of the same length share the rows they have in common
+class TwiddleRows:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.rows = collections.OrderedDict()
+        self.nbytes = 0
+
+    def get(self, n, k):
+        row = self.rows.get((n, k))
+        if row is not None:
+            self.rows.move_to_end((n, k))
+            return row
+
+        row = bins_twiddles(n, [k])[0]
+        self.rows[(n, k)] = row
+        self.nbytes += row.nbytes
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= self.rows.popitem(last=False)[1].nbytes
+        return row
+
+twiddle_rows = TwiddleRows(DFT_TWIDDLE_CACHE_BYTES)
+
+# DFT at (possibly fractional) bins, a product with the cached twiddle
+# row of every bin for small enough signals, otherwise all bins in one
+# matrix product with the twiddles built chunk by chunk
+def dft_bins(sig, bins):
+    sig = np.asarray(sig)
+    n = len(sig)
+    bins = np.atleast_1d(bins).tolist()
+    if len(bins) * n <= DFT_BINS_MAX_TWIDDLES:
+        return np.array([np.dot(twiddle_rows.get(n, k), sig) for k in bins],
+                        dtype=complex)
+
+    out = np.zeros(len(bins), dtype=complex)
+    step = max(1, DFT_BINS_MAX_TWIDDLES // len(bins))
+    for lo in range(0, n, step):
+        hi = min(n, lo + step)
+        out += bins_twiddles(n, bins, lo, hi) @ sig[lo:hi]
+    return out
+
+@functools.lru_cache(maxsize=64)
+def czt_plan(n, m, f_lo, f_hi, fs):
+    return signal.ZoomFFT(n, [f_lo, f_hi], m, fs=fs, endpoint=False)
+
+# m bins over [f_lo, f_hi) at any resolution, O((N+M) log(N+M))
+def czt(sig, f_lo, f_hi, m, fs=1):
+    sig = np.asarray(sig)
+    freq = f_lo + (f_hi - f_lo) * np.arange(m) / m
+    return czt_plan(len(sig), m, f_lo, f_hi, fs)(sig), freq
+
+def dft(sig, bins=None, band=None, m=None, fs=1):
+    sig = np.asarray(sig)
+    n = len(sig)
+
+    if band is not None:
+        return czt(sig, band[0], band[1], m or n, fs)[0]
+
+    if bins is not None:
+        bins = np.atleast_1d(bins)
+        if bins_are_cheaper(n, len(bins)) or \
+           not np.all(np.equal(np.mod(bins, 1), 0)):
+            return dft_bins(sig, bins)
+        return np.fft.fft(sig)[bins.astype(int) % n]
+
+    return np.fft.fft(sig)
+
+# Band around all bins of the spectrum above threshold (in magnitude),
+# widened by margin times its width on both sides and snapped outwards
+# to the FFT grid of n points. The whole spectrum is returned if nothing
+# is above, only non-negative frequencies are searched for real signals
+def zoom_band(sig, fs, threshold, margin=1, n=None):
+    sig = np.asarray(sig)
+    n = n or len(sig)
+    if np.iscomplexobj(sig):
+        mag = np.fft.fftshift(np.abs(np.fft.fft(sig, n)))
+        freq = np.fft.fftshift(np.fft.fftfreq(n, 1/fs))
+    else:
+        mag = np.abs(np.fft.rfft(sig, n))
+        freq = np.fft.rfftfreq(n, 1/fs)
+
+    idx = np.flatnonzero(mag > threshold)
+    if len(idx) == 0:
+        return freq[0], freq[-1]
+
+    lo, hi = freq[idx[0]], freq[idx[-1]]
+    d = (hi - lo) * margin
+    # At least one bin of margin, so a single bin still has a band
+    i_lo = np.searchsorted(freq, lo - d, side="right") - 1
+    i_hi = np.searchsorted(freq, hi + d)
+    i_lo = max(min(i_lo, idx[0] - 1), 0)
+    i_hi = min(max(i_hi, idx[-1] + 1), len(freq) - 1)
+    return freq[i_lo], freq[i_hi]
+
+# m bins of the band zoom_band() finds, the signal is cut or zero padded
+# to n samples like np.fft.fft(sig, n). Returns (spec, freq)
+def zoom(sig, fs, threshold, m=1024, margin=1, n=None):
+    sig = np.asarray(sig)[:n]
+    f_lo, f_hi = zoom_band(sig, fs, threshold, margin, n)
+    return czt(sig, f_lo, f_hi, m, fs)
+
+# Spectral peaks, magnitude is scaled to the amplitude of a complex
+# exponential (1/N for the rectangular window), dB is 20*log10(magnitude)
+PEAK_DTYPE = np.dtype([("freq", float), ("magnitude", float), ("db", float),
+                       ("phase", float)])
+
+# Local maxima of the two sided spectrum above threshold (in magnitude),
+# optionally only the top largest ones. Frequency and magnitude are
+# refined by fitting a parabola to the log magnitude of the peak bin and
+# its neighbours. window is an array or a function like np.hanning, the
+# magnitude is corrected by the coherent gain of the window. Only the
+# peaks get logarithms and phases computed, sorted by frequency.
+def peaks(sig, Fs, threshold=0.1, top=None, window=None):
+    sig = np.asarray(sig)
+    n = len(sig)
+    if window is not None:
+        if callable(window):
+            window = window(n)
+        sig = sig * window
+        gain = np.sum(window)
+    else:
+        gain = n
+
+    spec = np.fft.fft(sig)
+    mag = np.abs(spec) / gain
+
+    # Spectrum is circular, so DC and the edges are peaks as well
+    left = np.roll(mag, 1)
+    right = np.roll(mag, -1)
+    ind = np.flatnonzero((mag > threshold) & (mag > left) & (mag >= right))
+
+    if top is not None and len(ind) > top:
+        ind = ind[np.argpartition(mag[ind], len(ind) - top)[len(ind) - top:]]
+
+    # Neighbours at the rounding noise floor make the fit symmetric
+    floor = mag[ind] * 1e-12
+    a = np.log(np.maximum(left[ind], floor))
+    b = np.log(mag[ind])
+    c = np.log(np.maximum(right[ind], floor))
+    den = a - 2*b + c
+    p = np.where(den < 0, 0.5 * (a - c) / np.where(den < 0, den, 1), 0)
+
+    out = np.zeros(len(ind), dtype=PEAK_DTYPE)
+    out["freq"] = ((ind + p + n//2) % n - n//2) * Fs / n
+    out["magnitude"] = np.exp(b - 0.25 * (a - c) * p)
+    out["db"] = 20 * np.log10(out["magnitude"])
+    out["phase"] = np.angle(spec[ind])
+    out.sort(order="freq")
+
+    return out
+
+# The former qpsk.sft(), kept as a reference for the benchmark
+def sft_slow(sig):
+    n = len(sig)
+    zeta = np.exp(-2 * np.pi * 1j / n)
+    freq = np.array([np.array([sig[i] * zeta**(i * f) for i in range(0, n)]).sum()
+            for f in range(0, n)])
+    return freq
+
+def bench(name, fn, ref, repeat):
+    # Cached twiddles and plans are built outside the timing, repeated
+    # calls on equally sized frames is what the caches are for
+    if repeat > 1:
+        fn()
+    start = time.perf_counter()
+    for i in range(repeat):
+        out = fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    err = np.max(np.abs(out - ref)) if ref is not None else 0
+    print("%-24s %10.3f ms   max err %.2e" % (name, elapsed * 1e3, err))
+    return out
+
+def main():
+    rng = np.random.default_rng(0)
+    for n in (256, 1024, 2**20):
+        sig = rng.standard_normal(n)
+        print("N = %d" % n)
+        if n <= 1024:
+            ref = bench("sft (old)", lambda: sft_slow(sig), None, 1)
+        else:
+            ref = np.fft.fft(sig)
+        bench("dft (fft)", lambda: dft(sig), ref, 10)
+        bins = [10, 30]
+        bench("dft (bins, 2 bins)", lambda: dft(sig, bins), ref[bins], 10)
+        bench("fft, 2 bins", lambda: np.fft.fft(sig)[bins], ref[bins], 10)
+        zoom_ref = np.array([np.sum(sig * np.exp(-2j * np.pi * f *
+                                                 np.arange(n) / n))
+                             for f in 10 + 10 * np.arange(64) / 64])
+        bench("dft (czt, 64 bins)",
+              lambda: dft(sig, band=(10, 20), m=64, fs=n), zoom_ref, 10)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
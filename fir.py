@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+
+#
+# FIR filtering engine for signal.firwin() designed filters.
+#
+# FIRFilter picks the implementation from the number of taps, the size of
+# the block passed to process() and the decimation factor:
+#
+#   direct       - np.convolve, best for short filters or small blocks
+#   fft          - overlap-save FFT convolution, for long filters
+#   polyphase    - only the kept outputs are computed when decimating,
+#                  long filters are decimated after the FFT convolution
+#
+# Filter state (the last ntaps - 1 input samples) is kept between
+# process() calls, so a stream fed block by block gives the same output
+# as the whole signal filtered at once. Input is (..., samples), leading
+# dimensions are channels.
+#
+# Taps can be a (bands, ntaps) filter bank, the output is then
+# (..., bands, samples). The fft path transforms every input segment
+# once and multiplies it by the spectra of the whole bank.
+#
+# firwin_bank() designs a bank of firwin() bandpasses in one call and
+# keeps the coefficients in an on-disk cache (FIR_CACHE_DIR), cached
+# banks are memory-mapped on reload.
+#
+# freq_response() evaluates gain, phase and group delay of the taps,
+# either on an arbitrary frequency array or on a dense FFT grid.
+#
+# Running this file benchmarks the engine against np.convolve.
+#
+
+import sys, os, time, hashlib
+import numpy as np
+
+FIR_CACHE_DIR = os.environ.get("FIR_CACHE_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".fir-cache"))
+
+# np.convolve beats overlap-save below this many taps, or below this
+# many MACs per block, where the per-call FFT overhead dominates
+FIR_FFT_MIN_TAPS = 128
+FIR_FFT_MIN_MACS = 2**20
+# Polyphase decimation wins up to this many MACs per input sample
+FIR_POLYPHASE_MAX_MACS = 16
+
+def fir_method(ntaps, block, decim=1):
+    if decim > 1 and ntaps / decim <= FIR_POLYPHASE_MAX_MACS:
+        return "polyphase"
+    if ntaps >= FIR_FFT_MIN_TAPS and ntaps * block >= FIR_FFT_MIN_MACS:
+        return "fft"
+    return "direct"
+
+class FIRFilter:
+    def __init__(self, taps, decim=1, method=None):
+        self.taps = np.asarray(taps)
+        self.ntaps = self.taps.shape[-1]
+        self.bands = self.taps.shape[:-1]
+        self.decim = decim
+        # None picks the method for the size of every block
+        self.method = method
+        # Bank spectra per FFT size, broadcast against the (segs, nfft) input
+        self.spectra = {}
+        self.reset()
+
+    # FFT size for overlap-save: 8 times the filter, so that the ntaps - 1
+    # discarded samples of every segment are cheap, or one segment for
+    # smaller blocks
+    def fft_size(self, n):
+        nfft = min(max(8 * self.ntaps, 256), n + self.ntaps - 1)
+        nfft = 1 << int(np.ceil(np.log2(nfft)))
+        if nfft not in self.spectra:
+            self.spectra[nfft] = (np.fft.fft(self.taps, nfft)[..., None, :],
+                                  np.fft.rfft(self.taps, nfft)[..., None, :])
+        return nfft
+
+    def reset(self):
+        self.hist = None
+        # Index of the next decimated output within the coming block
+        self.next = 0
+
+    def process(self, x):
+        x = np.asarray(x)
+        if self.hist is None:
+            self.hist = np.zeros(x.shape[:-1] + (self.ntaps - 1,),
+                                 dtype=np.result_type(x, self.taps))
+        n = x.shape[-1]
+        if n == 0:
+            return np.empty(x.shape[:-1] + self.bands + (0,),
+                            dtype=self.hist.dtype)
+
+        buf = np.concatenate((self.hist, x), axis=-1)
+        self.hist = buf[..., buf.shape[-1]-(self.ntaps-1):]
+
+        method = self.method or fir_method(self.ntaps, n, self.decim)
+        if method == "polyphase":
+            return self.polyphase(buf, n)
+        if method == "fft":
+            out = self.overlap_save(buf, n)
+        else:
+            out = self.direct(buf)
+
+        if self.decim > 1:
+            out = out[..., self.next::self.decim]
+            self.next += out.shape[-1] * self.decim - n
+        return out
+
+    # Remaining ntaps - 1 samples of the filter tail
+    def flush(self):
+        if self.hist is None:
+            return np.empty(0)
+        shape = self.hist.shape[:-1] + (self.ntaps - 1,)
+        return self.process(np.zeros(shape, dtype=self.hist.dtype))
+
+    def direct(self, buf):
+        out = np.empty(buf.shape[:-1] + self.bands +
+                       (buf.shape[-1] - self.ntaps + 1,),
+                       dtype=np.result_type(buf, self.taps))
+        for ch in np.ndindex(buf.shape[:-1]):
+            for band in np.ndindex(self.bands):
+                out[ch + band] = np.convolve(buf[ch], self.taps[band],
+                                             mode="valid")
+        return out
+
+    def overlap_save(self, buf, n):
+        nfft = self.fft_size(n)
+        H, rH = self.spectra[nfft]
+        step = nfft - self.ntaps + 1
+        nsegs = -(-n // step)
+        pad = (nsegs - 1) * step + nfft - buf.shape[-1]
+        buf = np.pad(buf, [(0, 0)] * (buf.ndim - 1) + [(0, pad)])
+
+        segs = np.lib.stride_tricks.sliding_window_view(buf, nfft, axis=-1)
+        segs = segs[..., ::step, :]
+        # Segment spectra get a band axis for each bank dimension
+        segs = np.expand_dims(segs, tuple(range(-2 - len(self.bands), -2)))
+        if np.iscomplexobj(buf) or np.iscomplexobj(self.taps):
+            out = np.fft.ifft(np.fft.fft(segs) * H)
+        else:
+            out = np.fft.irfft(np.fft.rfft(segs) * rH, nfft)
+
+        # First ntaps - 1 outputs of every segment are circular aliases
+        out = out[..., self.ntaps - 1:]
+        out = out.reshape(out.shape[:-2] + (-1,))
+        return out[..., :n]
+
+    def polyphase(self, buf, n):
+        win = np.lib.stride_tricks.sliding_window_view(buf, self.ntaps,
+                                                        axis=-1)
+        taps = self.taps.reshape(-1, self.ntaps)[:, ::-1]
+        out = win[..., self.next::self.decim, :] @ taps.T
+        self.next += out.shape[-2] * self.decim - n
+        out = np.moveaxis(out, -1, -2)
+        return out.reshape(out.shape[:-2] + self.bands + out.shape[-1:])
+
+# Cache file of a firwin_bank() design
+def firwin_bank_path(numtaps, cutoffs, fs, window, scale, cache=FIR_CACHE_DIR):
+    key = repr((numtaps, np.asarray(cutoffs, dtype=float).tolist(),
+                float(fs), window, bool(scale)))
+    name = "firwin-%d-%s.npy" % (numtaps,
+                                 hashlib.sha1(key.encode()).hexdigest())
+    return os.path.join(cache, name)
+
+# Bank of signal.firwin() bandpasses, one per (f_lo, f_hi) row of
+# cutoffs, designed together as windowed sinc differences. An f_lo of 0
+# gives a lowpass, an f_hi of fs/2 a highpass (odd numtaps only).
+# The (bands, numtaps) coefficients are saved to the cache and returned
+# memory-mapped read-only; cache=None disables the cache.
+def firwin_bank(numtaps, cutoffs, fs, window="hamming", scale=True,
+                cache=FIR_CACHE_DIR):
+    from scipy import signal
+
+    if cache is not None:
+        path = firwin_bank_path(numtaps, cutoffs, fs, window, scale, cache)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode='r')
+
+    bands = np.atleast_2d(np.asarray(cutoffs, dtype=float)) / (fs / 2)
+    left, right = bands[:, :1], bands[:, 1:]
+    m = np.arange(numtaps) - 0.5 * (numtaps - 1)
+    h = right * np.sinc(right * m) - left * np.sinc(left * m)
+    h *= signal.get_window(window, numtaps, fftbins=False)
+
+    if scale:
+        # Unity gain at DC, at Nyquist or at the passband centre
+        freq = np.where(left == 0, 0., np.where(right == 1, 1.,
+                                                0.5 * (left + right)))
+        h /= np.sum(h * np.cos(np.pi * m * freq), axis=-1, keepdims=True)
+
+    if cache is None:
+        return h
+
+    os.makedirs(cache, exist_ok=True)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        np.save(f, h)
+    os.replace(tmp, path)
+    return np.load(path, mmap_mode='r')
+
+# Gain, unwrapped phase and group delay (in samples) of the FIR taps.
+# With `freqs` given, H(f) is evaluated there in one matrix product,
+# otherwise on the rfft grid of `nfft` points (full fft for complex taps)
+def freq_response(taps, freqs=None, fs=2*np.pi, nfft=4096):
+    taps = np.asarray(taps)
+    k = np.arange(len(taps))
+    if freqs is None:
+        if np.iscomplexobj(taps):
+            freqs = np.fft.fftfreq(nfft, 1/fs)
+            H = np.fft.fft(taps, nfft)
+            dH = np.fft.fft(k * taps, nfft)
+        else:
+            freqs = np.fft.rfftfreq(nfft, 1/fs)
+            H = np.fft.rfft(taps, nfft)
+            dH = np.fft.rfft(k * taps, nfft)
+    else:
+        freqs = np.asarray(freqs, dtype=float)
+        zeta = np.exp(-2j*np.pi/fs * np.multiply.outer(freqs, k))
+        H = zeta @ taps
+        dH = zeta @ (k * taps)
+
+    # -dphi/dw = Re(sum(k h[k] e^-jwk) / H), undefined on the zeros of H
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gdelay = np.where(np.abs(H) > 0, np.real(dH / H), np.nan)
+
+    return freqs, np.abs(H), np.unwrap(np.angle(H)), gdelay
+
+# Min and max gain over [f_lo, f_hi], to check pass and stop band specs
+def band_gain(taps, band, fs=2*np.pi, n=1000):
+    freqs, gain, phase, gdelay = freq_response(taps, np.linspace(*band, n), fs)
+    return gain.min(), gain.max()
+
+def bench(name, fn, ref, repeat=3):
+    start = time.perf_counter()
+    for i in range(repeat):
+        out = fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print("%-28s %9.2f ms   max err %.2e" %
+          (name, elapsed * 1e3, np.max(np.abs(out - ref))))
+
+def main():
+    from scipy import signal
+
+    rng = np.random.default_rng(0)
+    Fs = 512
+    x = rng.standard_normal(2**22)
+    for numtaps in (71, 255, 1023):
+        bandpass = signal.firwin(numtaps=numtaps, cutoff=[35, 45], scale=True,
+                                 pass_zero=False, fs=Fs)
+        print("%d taps, %d samples" % (numtaps, len(x)))
+        ref = np.convolve(x, bandpass)[:len(x)]
+        bench("np.convolve", lambda: np.convolve(x, bandpass)[:len(x)], ref)
+        for method in ("direct", "fft"):
+            bench("FIRFilter (%s)" % method,
+                  lambda: FIRFilter(bandpass, method=method).process(x), ref)
+        for block in (256, 2**16):
+            bench("FIRFilter (%d blocks)" % block, lambda: np.concatenate(
+                [f.process(x[i:i+block]) for f in [FIRFilter(bandpass)]
+                 for i in range(0, len(x), block)]), ref)
+        for method in ("polyphase", "fft"):
+            bench("FIRFilter (%s, /8)" % method, lambda:
+                  FIRFilter(bandpass, decim=8, method=method).process(x),
+                  ref[::8])
+
+    # Ultrasonic bank: 32 bandpasses of 2 kHz around 40 kHz
+    fs = 400e3
+    centres = np.linspace(30e3, 50e3, 32)
+    bank = firwin_bank(255, np.stack((centres - 1e3, centres + 1e3), -1), fs)
+    x = x[:2**20]
+    print("%d x %d taps bank, %d samples" % (*bank.shape, len(x)))
+    ref = np.array([np.convolve(x, h)[:len(x)] for h in bank])
+    bench("np.convolve per band", lambda: np.array(
+        [np.convolve(x, h)[:len(x)] for h in bank]), ref, repeat=1)
+    bench("FIRFilter (fft, bank)", lambda:
+          FIRFilter(bank, method="fft").process(x), ref, repeat=1)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
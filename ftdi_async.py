@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+#
+# asyncio friendly FTDI transport.
+#
+# A single I/O thread owns the device (libftdi contexts are not thread
+# safe). It writes every submitted command buffer as soon as possible and
+# then reads the responses back in the same order, accumulating partial
+# reads until the expected byte count or a deadline. Reads may return
+# immediately with less data than requested, see:
+#
+# https://libftdi.developer.intra2net.narkive.com/qIRkD5AR/ftdi-read-data-returns-immediately-without-waiting-for-timeout-and-with-no-data
+#
+# Up to max_inflight command batches are in flight, so host side
+# processing of one response overlaps the device executing the next ones.
+#
+# A read timeout fails the transfers in flight and purges their late
+# responses. A device error, or responses that never come, fail every
+# transfer and close the transport.
+#
+
+import asyncio, collections, queue, threading, time
+
+# Poll interval while waiting for the device to fill its buffer
+FTDI_READ_POLL_S = 100e-6
+
+# Queued by close(), the I/O thread exits once all reads are done
+FTDI_CLOSE = object()
+
+class FtdiAsync:
+    def __init__(self, d, timeout=1.0, max_inflight=4):
+        self.d = d
+        self.timeout = timeout
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.jobs = queue.Queue()
+        self.closed = False
+        # Orders closed against the jobs queued by transfer()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.io_thread, daemon=True)
+        self.thread.start()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        # Transfers still waiting for a slot fail, the queued ones finish
+        with self.lock:
+            self.closed = True
+            self.jobs.put(FTDI_CLOSE)
+        await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+
+    # Write cmd and return the nbytes long response
+    async def transfer(self, cmd, nbytes, timeout=None):
+        loop = asyncio.get_running_loop()
+        # Released by complete(), a cancelled caller keeps its slot until
+        # the I/O thread is done with the job
+        await self.inflight.acquire()
+        fut = loop.create_future()
+        with self.lock:
+            if self.closed:
+                self.inflight.release()
+                raise IOError("transport closed")
+            self.jobs.put((loop, fut, bytes(cmd), nbytes,
+                           self.timeout if timeout is None else timeout))
+        return await fut
+
+    # Write cmd without waiting for a response
+    async def write(self, cmd):
+        return await self.transfer(cmd, 0)
+
+    def complete(self, job, result=None, exc=None):
+        loop, fut = job[0], job[1]
+
+        def set_result():
+            self.inflight.release()
+            if fut.done():
+                return
+            if exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(result)
+
+        loop.call_soon_threadsafe(set_result)
+
+    def io_thread(self):
+        reads = collections.deque()
+        job = None
+        closing = False
+        try:
+            while not closing or reads:
+                # Issue all queued writes first, block only if nothing to read
+                try:
+                    job = self.jobs.get(block=not reads)
+                except queue.Empty:
+                    job = None
+                if job is FTDI_CLOSE:
+                    closing = True
+                    job = None
+                    continue
+                if job is not None:
+                    cmd, nbytes = job[2], job[3]
+                    ret = self.d.write(cmd) if cmd else 0
+                    if ret != len(cmd):
+                        self.complete(job, exc=IOError("short write %d of %d" %
+                                                       (ret, len(cmd))))
+                    elif nbytes:
+                        reads.append((job, time.perf_counter() + job[4]))
+                    else:
+                        self.complete(job, b"")
+                    job = None
+                    continue
+
+                job, deadline = reads.popleft()
+                rd = self.read_exact(job[3], deadline)
+                if len(rd) == job[3]:
+                    self.complete(job, rd)
+                    job = None
+                    continue
+
+                # Response stream can't be realigned, fail everything in
+                # flight and drop the bytes they still owe, which would
+                # otherwise be returned to the next transfers
+                exc = TimeoutError("read %d of %d bytes" % (len(rd), job[3]))
+                owed = job[3] - len(rd)
+                self.complete(job, exc=exc)
+                job = None
+                while reads:
+                    owed += reads[0][0][3]
+                    self.complete(reads.popleft()[0], exc=exc)
+                if not self.purge(owed):
+                    raise exc
+        except Exception as exc:
+            # Device state is unknown, fail every transfer and refuse new ones
+            with self.lock:
+                self.closed = True
+            if job is not None:
+                self.complete(job, exc=exc)
+            for job, deadline in reads:
+                self.complete(job, exc=exc)
+            while not self.jobs.empty():
+                job = self.jobs.get()
+                if job is not FTDI_CLOSE:
+                    self.complete(job, exc=exc)
+
+    # Read and drop nbytes late response bytes, then clear the RX buffer.
+    # False if they don't arrive in time, the device is then out of step
+    def purge(self, nbytes):
+        rd = self.read_exact(nbytes, time.perf_counter() + self.timeout)
+        self.d.flush_input()
+        return len(rd) == nbytes
+
+    def read_exact(self, nbytes, deadline):
+        rd = bytearray()
+        while len(rd) < nbytes:
+            rd += self.d.read(nbytes - len(rd))
+            if len(rd) < nbytes:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                # Let the device fill its buffer instead of spinning
+                time.sleep(min(FTDI_READ_POLL_S, remaining))
+
+        return bytes(rd)
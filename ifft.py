@@ -13,143 +13,185 @@
 # tone at 440 Hz and we add a Gaussian shaped pulse at 880.
 #
 
+import functools
 from mpl_toolkits.mplot3d import Axes3D
 import matplotlib.pyplot as plt
 import numpy as np
 import soundfile as sf
-from scipy.ndimage import uniform_filter1d
+from scipy.ndimage import convolve1d
 from scipy.ndimage import gaussian_filter1d
-from scipy.signal import savgol_filter
+from scipy.signal import savgol_coeffs
 from matplotlib.colors import LightSource
 from matplotlib import cm
 
-import drawsvg as dw
-
 #plt.rcParams['figure.dpi'] = 100
 plt.rcParams['figure.figsize'] = (150, 15)
 
 
-# Input the wave file
-data, rate = sf.read("homyak.wav")
-#data, rate = sf.read("tones.wav")
-
-chunk_dur_s = 0.2
-overlap_dur_s = 0.15
-beg_pos_s = 0
-dur_s = len(data) / rate
-chunk_len = int(chunk_dur_s * rate)
-overlap_len = int(overlap_dur_s * rate)
-assert chunk_len > overlap_len
-
-beg_ind = int(beg_pos_s * rate)
-
-# Get the list of frequencies
-freq = np.fft.rfftfreq(chunk_len, d=1./rate)
-freq_lim = (np.abs(freq - 1000)).argmin()
-
-freq = freq[:freq_lim]
-
-chunks_n = int((len(data) - chunk_len) / (chunk_len - overlap_len)) + 1
-
-y_time = np.linspace(0, dur_s, chunks_n)
-X, Y = np.meshgrid(freq, y_time)
-Z = np.empty(shape=(0, len(freq)))
-
-while beg_ind + chunk_len < len(data):
-    chunk = data[beg_ind:beg_ind+chunk_len]
-    assert len(chunk) == chunk_len
-    beg_ind += (chunk_len - overlap_len)
-
-    # Fourier transform
-    fft_data = np.fft.rfft(chunk)
-    mag_data = np.abs(fft_data)[:freq_lim]
+# Savitzky-Golay coefficients only depend on the window and the order
+@functools.lru_cache(maxsize=None)
+def savgol_kernel(window, order):
+    return savgol_coeffs(window, order)
+
+# Moving average through a cumulative sum, so the cost does not depend on
+# the window length. Same output as uniform_filter1d(mode="reflect").
+def uniform_cumsum(x, size, axis=-1):
+    x = np.moveaxis(np.asarray(x, dtype=float), axis, -1)
+    left = size // 2
+    pad = [(0, 0)] * (x.ndim - 1) + [(left + 1, size - 1 - left)]
+    c = np.pad(x, pad, mode="symmetric")
+    c[..., 0] = 0
+    np.cumsum(c, axis=-1, out=c)
+    out = (c[..., size:] - c[..., :-size]) / size
+    return np.moveaxis(out, -1, axis)
+
+# Smooth spectra along the given axis (frequency by default) in one call,
+# works for a single spectrum and for a (chunks x bins) matrix alike
+def smooth(mag_data, filt, hist_window=50, sigma=6, order=5, axis=-1):
+    if filt is None:
+        return mag_data
+    if filt == "savgol":
+        return convolve1d(mag_data, savgol_kernel(hist_window, order),
+                          axis=axis, mode="nearest")
+    if filt == "uniform":
+        return uniform_cumsum(mag_data, hist_window, axis=axis)
+    if filt == "gaussian":
+        return gaussian_filter1d(mag_data, sigma=sigma,
+                                 axis=axis, mode="reflect")
+    raise ValueError("Unknown filter '%s'" % filt)
+
+# Min/max-per-pixel decimation of a trace sorted by x: for every column
+# of `tolerance` pixels only the first, last, lowest and highest points
+# are kept, so the polyline is drawn the same at the target resolution.
+# Non-finite points are dropped, the polyline bridges them.
+def decimate_trace(x, y, tolerance=1.):
+    x = np.asarray(x)
+    y = np.asarray(y)
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+    n = len(x)
+    if n < 3:
+        return x, y
+
+    col = np.floor((x - x[0]) / tolerance).astype(np.int64)
+    beg = np.flatnonzero(np.diff(col, prepend=col[0] - 1))
+    end = np.append(beg[1:], n) - 1
+    counts = end - beg + 1
+
+    ind = np.arange(n)
+    ymin = np.repeat(np.minimum.reduceat(y, beg), counts)
+    ymax = np.repeat(np.maximum.reduceat(y, beg), counts)
+    imin = np.minimum.reduceat(np.where(y == ymin, ind, n), beg)
+    imax = np.minimum.reduceat(np.where(y == ymax, ind, n), beg)
+
+    keep = np.unique(np.concatenate((beg, end, imin, imax)))
+    return x[keep], y[keep]
+
+# Save a (x, y) trace as svg polyline of width x height pixels, y is
+# scaled by scale_y. The trace is decimated first and the path is
+# streamed to the file with compact number formatting.
+def save_svg_trace(filename, x, y, width, height, scale_y=1, tolerance=1.,
+                   digits=2, stroke='black'):
+    x, y = decimate_trace(x, y, tolerance)
+    fmt = "%%.%df" % digits
+
+    with open(filename, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<svg xmlns="http://www.w3.org/2000/svg" '
+                'width="%d" height="%d" viewBox="0 0 %d %d">\n' %
+                (width, height, width, height))
+        f.write('<path fill="none" stroke="%s" transform="scale(1, %g)" d="M' %
+                (stroke, scale_y))
+        np.savetxt(f, np.column_stack((x, y)), fmt=fmt, delimiter=",",
+                   newline=" ")
+        f.write('"/>\n</svg>\n')
+
+# Spectra in dB of overlapping chunks of the signal up to freq_lim Hz.
+# Frames are taken through a strided view and FFT-ed in batches straight
+# into the preallocated output, only the requested filter is applied.
+# Optionally the spectra are smoothed along the time axis afterwards.
+def chunk_spectrum(data, rate, chunk_dur_s=0.2, overlap_dur_s=0.15,
+                   freq_lim=1000, beg_pos_s=0, filt="uniform",
+                   hist_window=50, sigma=6, time_filt=None, time_window=3,
+                   time_sigma=1, batch=64):
+    chunk_len = int(chunk_dur_s * rate)
+    overlap_len = int(overlap_dur_s * rate)
+    assert chunk_len > overlap_len
+    hop_len = chunk_len - overlap_len
+
+    beg_ind = int(beg_pos_s * rate)
+    data = data[beg_ind:]
+    dur_s = len(data) / rate
+
+    # Get the list of frequencies
+    freq = np.fft.rfftfreq(chunk_len, d=1./rate)
+    freq_ind = (np.abs(freq - freq_lim)).argmin()
+    freq = freq[:freq_ind]
+
+    chunks_n = max(int((len(data) - chunk_len) / hop_len) + 1, 0)
+    y_time = np.linspace(0, dur_s, chunks_n)
+    Z = np.empty(shape=(chunks_n, len(freq)))
+    if chunks_n == 0:
+        return freq, y_time, Z
+
+    chunks = np.lib.stride_tricks.sliding_window_view(data, chunk_len, axis=0)
+    chunks = chunks[::hop_len][:chunks_n]
+
+    for i in range(0, chunks_n, batch):
+        # Fourier transform
+        fft_data = np.fft.rfft(chunks[i:i+batch], axis=-1)
+        mag_data = np.abs(fft_data[:, :freq_ind])
+
+        # amplitude to decibel
+        mag_data[ mag_data == 0 ] = 1e-9 # avoid zeros
+        db = 20.*np.log10(mag_data)
+
+        Z[i:i+batch] = smooth(db, filt, hist_window, sigma)
+
+    if time_filt is not None:
+        Z = smooth(Z, time_filt, time_window, time_sigma,
+                   order=min(5, time_window - 1), axis=0)
+
+    return freq, y_time, Z
+
+
+if __name__ == "__main__":
+    # Input the wave file
+    data, rate = sf.read("homyak.wav")
+    #data, rate = sf.read("tones.wav")
 
     hist_window = 50
+    freq, y_time, db = chunk_spectrum(data, rate, chunk_dur_s=0.2,
+                                      overlap_dur_s=0.15, freq_lim=1000,
+                                      filt=None)
+    X, Y = np.meshgrid(freq, y_time)
+    Z = smooth(db, "uniform", hist_window)
+    # Last chunk only
+    f1 = smooth(db[-1], "savgol", hist_window)
 
+    fig = plt.figure()
+    ax3d = fig.add_subplot(111, projection='3d')
 
-    # amplitude to decibel
-    mag_data[ mag_data == 0 ] = 1e-9 # avoid zeros
-    db = 20.*np.log10(mag_data)
-    mag_data = db
-
-
-    f1 = savgol_filter(mag_data, hist_window, 5,
-                       axis=0, mode="nearest")
-    f2 = uniform_filter1d(mag_data, size=hist_window,
-                          axis=0, mode="reflect")
-    f3 = gaussian_filter1d(mag_data, sigma=6,
-                           axis=0, mode="reflect")
-
-    Z = np.append(Z, [f2], axis=0)
-
-
-    # Find the bin closest to 4kHz and attenuate
-    #idx = (np.abs(freq - 4.E3)).argmin()
-    #fft_data[idx] *= 1./100
-
-    # Find the bin closest to 7kHz and attenuate
-    #idx = (np.abs(freq - 7.E3)).argmin()
-    #fft_data[idx] *= 1./100
-
-    #for i in range(3000, len(FFT_data)):
-    #    fft_data[i] = 0
-
-    #idx_low = (np.abs(freq - 200)).argmin()
-    #idx_high = (np.abs(freq - 4000)).argmin()
-    #idx_low = 0
-    #idx_high = len(fft_data)
-
-
-    # Find the bin closest to 440 Hz and set a continuous tone
-    #idx = (np.abs(freq - 440)).argmin()
-    #fft_data[idx] = np.max(np.abs(fft_data))
-
-    #zeros = np.zeros(fft_data.shape)
-    #zeros += 3000 * np.exp( -((freq-880)*1000.)**2 )
-
-
-    ## Add a Gaussian pulse, width in frequency is inverse of its duration
-    #fft_data += np.max(np.abs(fft_data))/2. * np.exp( -((freq-880)/5.)**2 )
-
-
-    # Convert back to time domain
-    #newdata = np.fft.irfft(fft_data)
-    #newdata = np.fft.irfft(zeros)
-
-    # And save it to a new wave file
-    #sf.write(file="test.wav", data=newdata, samplerate=rate)
-
-
-
-fig = plt.figure()
-ax3d = fig.add_subplot(111, projection='3d')
-
-# Scale 'y' axis
-ax3d.set_box_aspect(aspect = (1,3,1))
-
-#ax3d.plot_wireframe(X, Y, Z, cstride=0)
-ax3d.plot_surface(X, Y, Z, cmap = plt.cm.cividis)
+    # Scale 'y' axis
+    ax3d.set_box_aspect(aspect = (1,3,1))
 
+    #ax3d.plot_wireframe(X, Y, Z, cstride=0)
+    ax3d.plot_surface(X, Y, Z, cmap = plt.cm.cividis)
 
 
-ax = fig.add_subplot(212)
-ax.plot(freq, f1)
 
+    ax = fig.add_subplot(212)
+    ax.plot(freq, f1)
 
-plt.show()
 
+    plt.show()
 
 
-# Convert 'y' axis to svg coordinate system
-y = f1 * -1
 
-w = int(np.ceil(np.max(freq)))
-h = int(np.ceil(np.max(y)))
-p = np.array([freq, y]).transpose().flatten().tolist()
+    # Convert 'y' axis to svg coordinate system
+    y = f1 * -1
 
-d = dw.Drawing(w, h*4, id_prefix='pic')
-#d.view_box = (0,0,10,10)
-lines = dw.Lines(p[0], p[1], *p[2:], fill='none', stroke='black')
-lines = dw.Use(lines, 0, 0, stroke='red', transform='scale(1, 4)')
-d.append(lines)
-d.save_svg('example.svg')
+    w = int(np.ceil(np.max(freq)))
+    h = int(np.ceil(np.max(y)))
+    save_svg_trace('example.svg', freq, y, w, h*4, scale_y=4)
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+#
+# Array in, array out building blocks for the BPSK/QPSK experiments in
+# qpsk.py. Everything works on whole time vectors or sample blocks, long
+# streams are generated in fixed size chunks.
+#
+
+import functools
+import numpy as np
+
+# 45, 135, 225, 315 degrees for 0 to 3
+def qpsk_symbols(x_int):
+    x_radians = (np.asarray(x_int) * 360 / 4.0 + 45) * np.pi / 180.0
+    return np.cos(x_radians) + 1j * np.sin(x_radians)
+
+# Symbols active at time instants t, the symbol table repeats
+def symbols_at(t, symbols, Fsymbols):
+    symbols = np.asarray(symbols)
+    ind = np.floor(np.asarray(t) * Fsymbols).astype(np.int64)
+    return symbols[ind % len(symbols)]
+
+# Carrier multiplied by +1/-1 symbols, returns signal and symbols
+def bpsk_modulate(t, symbols, Fsymbols, Fcarrier):
+    symb = symbols_at(t, symbols, Fsymbols)
+    return np.cos(2*np.pi*np.asarray(t)*Fcarrier) * symb, symb
+
+# I on cosine, Q on negative sine, returns signal and symbols
+def qpsk_modulate(t, symbols, Fsymbols, Fcarrier):
+    symb = symbols_at(t, symbols, Fsymbols)
+    phase = 2*np.pi*np.asarray(t)*Fcarrier
+    return symb.real * np.cos(phase) - symb.imag * np.sin(phase), symb
+
+# Generates nsamples of a modulated signal in chunks of chunk samples,
+# so minutes of test waveform never have to be in memory at once
+def modulate_stream(modulate, symbols, Fs, Fsymbols, Fcarrier, nsamples,
+                    chunk=2**16):
+    for beg in range(0, nsamples, chunk):
+        t = np.arange(beg, min(beg + chunk, nsamples)) / Fs
+        yield modulate(t, symbols, Fsymbols, Fcarrier)
+
+# Interpolation by L with FIR h working at the symbol rate: the same as
+# zero stuffing the input and convolving it with h, but only non-zero
+# input samples are multiplied. Input history is carried between blocks.
+class PolyphaseInterpolator:
+    def __init__(self, h, L):
+        h = np.asarray(h)
+        self.L = L
+        self.ntaps = len(h)
+        J = -(-len(h) // L)
+        # Phase p is h[p], h[p+L], h[p+2L], ..., reversed for correlation
+        self.phases = np.pad(h, (0, J*L - len(h))).reshape(J, L)[::-1]
+        self.hist = np.zeros(J - 1, dtype=h.dtype)
+
+    def process(self, x):
+        x = np.asarray(x)
+        if len(x) == 0:
+            return np.zeros(0, dtype=np.result_type(x, self.phases))
+        buf = np.concatenate((self.hist, x))
+        J = len(self.phases)
+        if J > 1:
+            self.hist = buf[len(buf)-(J-1):]
+        win = np.lib.stride_tricks.sliding_window_view(buf, J)
+        return (win @ self.phases).ravel()
+
+    # Remaining len(h) - 1 samples of the filter tail
+    def flush(self):
+        nzeros = -(-(self.ntaps - 1) // self.L)
+        tail = self.process(np.zeros(nzeros, dtype=self.hist.dtype))
+        return tail[:self.ntaps - 1]
+
+# FIR h followed by decimation by M, e.g. the matched filter of a
+# receiver sampling once per symbol. Only the kept outputs are computed:
+# output k is the filter output at input sample phase + k*M of the
+# whole stream. Input history is carried between blocks.
+class PolyphaseDecimator:
+    def __init__(self, h, M, phase=0):
+        h = np.asarray(h)
+        self.M = M
+        self.taps = h[::-1]
+        self.hist = np.zeros(len(h) - 1, dtype=h.dtype)
+        # Index of the next output within the coming block
+        self.next = phase
+
+    def process(self, x):
+        x = np.asarray(x)
+        if len(x) == 0:
+            return np.zeros(0, dtype=np.result_type(x, self.taps))
+        buf = np.concatenate((self.hist, x))
+        ntaps = len(self.taps)
+        if ntaps > 1:
+            self.hist = buf[len(buf)-(ntaps-1):]
+
+        win = np.lib.stride_tricks.sliding_window_view(buf, ntaps)
+        out = win[self.next::self.M] @ self.taps
+        self.next += len(out) * self.M - len(x)
+
+        return out
+
+# Folds frequencies into the first Nyquist zone the way sampling at Fs
+# aliases them, odd zones are mirrored
+def fold_freq(f, Fs):
+    nyquist = int(Fs) // 2
+    f = np.asarray(f)
+    odd = np.floor_divide(f, nyquist) % 2 == 1
+    return np.where(odd, np.mod(-f, nyquist), np.mod(f, nyquist))
+
+# Aliases of the mixing products of every tone with every shift (LO)
+# frequency: (shifts x tones) matrices of folded freq - shift and
+# freq + shift, so thousands of LO candidates are checked in one go
+def alias_matrix(freqs, shifts, Fs):
+    f = np.asarray(freqs)[np.newaxis, :]
+    s = np.asarray(shifts)[:, np.newaxis]
+    return fold_freq(f - s, Fs), fold_freq(f + s, Fs)
+
+# Samples of exp(2j*pi*k/2**bits)
+@functools.lru_cache(maxsize=4)
+def nco_lut(bits):
+    return np.exp(2j*np.pi*np.arange(1 << bits) / (1 << bits))
+
+# 1, j, -1, -j: quarter turns for the Fs/4, Fs/2 and DC frequencies
+NCO_QUARTERS = np.array([1, 1j, -1, -1j])
+
+# Numerically controlled oscillator: 32 bit phase accumulator and a
+# lookup table indexed by the top lut_bits of the phase, the phase is
+# carried between blocks. Frequencies which are multiples of Fs/4
+# (with a phase in quarter turns) only ever take 1, j, -1, -j values.
+class NCO:
+    def __init__(self, f, Fs, phase=0., lut_bits=16):
+        self.inc = int(round(f / Fs * 2**32)) % 2**32
+        self.phase = int(round(phase / (2*np.pi) * 2**32)) % 2**32
+        self.lut_bits = lut_bits
+        self.quarters = self.inc % 2**30 == 0 and self.phase % 2**30 == 0
+
+    # Phase of the next n samples, advances the oscillator
+    def step(self, n):
+        phases = (self.phase + self.inc * np.arange(n, dtype=np.uint64)) & \
+                 np.uint64(2**32 - 1)
+        self.phase = (self.phase + self.inc * n) % 2**32
+        return phases
+
+    # Quarter turns (0 to 3) of the samples r, r+4, r+8, ... for r = 0..3
+    # of the next n samples, the sequence repeats every 4 samples
+    def step_quarters(self, n):
+        q0 = self.phase >> 30
+        k = self.inc >> 30
+        self.phase = (self.phase + self.inc * n) % 2**32
+        return [(q0 + k * r) % 4 for r in range(4)]
+
+    # Next n samples of the complex local oscillator
+    def lo(self, n):
+        if self.quarters:
+            return np.resize(NCO_QUARTERS[self.step_quarters(n)], n)
+        phases = self.step(n) >> np.uint64(32 - self.lut_bits)
+        return nco_lut(self.lut_bits)[phases.astype(np.intp)]
+
+# out[r::4] = +/- src[r::4]
+def quarter_copy(out, src, r, neg):
+    if neg:
+        out[r::4] = -src[r::4]
+    else:
+        out[r::4] = src[r::4]
+
+# Mixer for arbitrarily long streams processed in blocks. For multiples
+# of Fs/4 the products with 1, j, -1, -j are just sign flips and
+# real/imaginary swaps, so no multiplications are done.
+class Mixer:
+    def __init__(self, f, Fs, phase=0., lut_bits=16):
+        self.nco = NCO(f, Fs, phase, lut_bits)
+
+    # Complex baseband u to real passband: i*cos() - q*sin()
+    def upconvert(self, u):
+        u = np.asarray(u)
+        if not self.nco.quarters:
+            return (u * self.nco.lo(len(u))).real
+
+        # Re(u * j**q) is i, -q, -i, q
+        i = np.real(u)
+        qq = np.imag(u)
+        out = np.empty(len(u))
+        for r, q in enumerate(self.nco.step_quarters(len(u))):
+            quarter_copy(out, (i, qq)[q & 1], r, q in (1, 2))
+        return out
+
+    # Real or complex passband x to complex baseband
+    def downconvert(self, x):
+        x = np.asarray(x)
+        if not self.nco.quarters:
+            return x * np.conj(self.nco.lo(len(x)))
+
+        # Multiplied by 1, -j, -1, j
+        i = np.real(x)
+        qq = np.imag(x)
+        out = np.empty(len(x), dtype=complex)
+        for r, q in enumerate(self.nco.step_quarters(len(x))):
+            quarter_copy(out.real, (i, qq)[q & 1], r, q in (2, 3))
+            quarter_copy(out.imag, (qq, i)[q & 1], r, q in (1, 2))
+        return out
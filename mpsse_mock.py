@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+
+#
+# Software stand-in for the FT232H bluepill clone with a TUSS4470 on the
+# SPI bus, for driver testing and benchmarking without hardware.
+#
+# MockMPSSE parses the MPSSE command stream written to it, keeps the
+# responses until they are read back, counts USB transfers and bytes and
+# charges a simulated USB latency for every transfer. MockTUSS4470
+# emulates register access over SPI including the parity check and the
+# status bits, and drives the OUT4 echo pin some time after a burst.
+#
+# Running this file benchmarks the TUSS4470 driver against the mock.
+#
+
+import time, sys
+from tuss4470 import *
+
+# Bad command response
+BAD_COMMAND = 0xfa
+
+# Device id and revision, the rest of the registers start at reset values
+TUSS_REV_ID = 0x01
+
+class MockTUSS4470:
+    def __init__(self, echo_s=0.0015):
+        self.regs = dict(TUSS_CONFIG_REGS_RESET)
+        self.regs[TUSS_REG_DEV_STAT] = 0x00
+        self.regs[TUSS_REG_DEVICE_ID] = TUSS_DEVICE_ID
+        self.regs[TUSS_REG_REV_ID] = TUSS_REV_ID
+        # Echo arrives echo_s seconds after a burst
+        self.echo_s = echo_s
+        self.burst_time = None
+
+    def status(self):
+        return self.regs[TUSS_REG_DEV_STAT] & ((1<<5)-1)
+
+    # One 16 bit SPI frame, returns 2 response bytes
+    def spi_transfer(self, b1, b2):
+        status = self.status() << 1
+        if tuss_calc_parity_bit([b1 & 0xfe, b2]) != b1 & 1:
+            return (0x80 | status, 0x00)
+
+        reg = (b1 >> 1) & 0x3f
+        if b1 & TUSS_SPI_READ_BIT:
+            return (status, self.regs.get(reg, 0x00))
+
+        if reg in TUSS_CONFIG_REGS_RESET:
+            self.regs[reg] = b2
+        # Write is acknowledged with the address byte
+        return (status, b1 & 0xfe)
+
+    def burst(self, now):
+        self.burst_time = now
+
+    def out4(self, now):
+        # Low when the echo crosses the threshold
+        cmp_en = self.regs[TUSS_REG_ECHO_INT_CONFIG] & TUSS_ECHO_INT_CONFIG_CMP_EN
+        if (cmp_en and self.burst_time is not None and
+            now - self.burst_time >= self.echo_s):
+            return 0
+        return ECHO_PIN
+
+class MockFtdiFn:
+    def ftdi_set_bitmode(self, mask, mode):
+        return 0
+
+class MockMPSSE:
+    def __init__(self, tuss=None, latency=125e-6, realtime=False):
+        self.tuss = tuss or MockTUSS4470()
+        self.ftdi_fn = MockFtdiFn()
+        # USB latency charged per transfer, slept for real if realtime
+        self.latency = latency
+        self.realtime = realtime
+        self.pins = CS_PIN|IO1_PIN
+        self.clock_hz = 6e6
+        self.clock_pin = SK_PIN
+        # Simulated device time, advanced by clocking
+        self.now = 0.0
+        self.rx = bytearray()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.writes = 0
+        self.reads = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.usb_time = 0.0
+
+    def transfer(self):
+        self.usb_time += self.latency
+        self.now += self.latency
+        if self.realtime:
+            time.sleep(self.latency)
+
+    def clock(self, nclocks):
+        self.now += nclocks / self.clock_hz
+
+    def write(self, data):
+        self.writes += 1
+        self.bytes_out += len(data)
+        self.transfer()
+
+        i = 0
+        while i < len(data):
+            cmd = data[i]
+            if cmd == SET_BITS_LOW:
+                self.pins = data[i+1] & data[i+2] | self.pins & ~data[i+2]
+                i += 3
+            elif cmd == GET_BITS_LOW:
+                self.rx.append(self.pins & OUT_PINS | self.tuss.out4(self.now))
+                i += 1
+            elif cmd == TCK_DIVISOR:
+                div = data[i+1] | data[i+2] << 8
+                self.clock_hz = 12000000 / ((div + 1) * 2)
+                i += 3
+            elif cmd == CLK_BYTES:
+                n = (data[i+1] | data[i+2] << 8) + 1
+                if self.clock_pin == IO2_PIN:
+                    self.tuss.burst(self.now)
+                self.clock(n * 8)
+                i += 3
+            elif cmd == MPSSE_DO_READ | MPSSE_DO_WRITE:
+                n = (data[i+1] | data[i+2] << 8) + 1
+                out = data[i+3:i+3+n]
+                if self.pins & CS_PIN or n != 2:
+                    # Nobody is selected, MISO is pulled up
+                    self.rx += bytes([0xff] * n)
+                else:
+                    self.rx += bytes(self.tuss.spi_transfer(out[0], out[1]))
+                self.clock(n * 8)
+                i += 3 + n
+            elif cmd == SET_CLK_PIN:
+                self.clock_pin = 1 << data[i+1]
+                i += 2
+            elif cmd == SEND_IMMEDIATE:
+                i += 1
+            else:
+                self.rx += bytes((BAD_COMMAND, cmd))
+                i += 1
+
+        return len(data)
+
+    def read(self, nbytes):
+        self.reads += 1
+        self.transfer()
+
+        rd = bytes(self.rx[:nbytes])
+        del self.rx[:nbytes]
+        self.bytes_in += len(rd)
+
+        return rd
+
+    def flush_input(self):
+        self.rx.clear()
+
+def bench(name, d, fn, n=100):
+    d.reset_stats()
+    start = time.perf_counter()
+    for i in range(n):
+        fn()
+    elapsed = time.perf_counter() - start
+
+    print("%-20s %6.1f writes %6.1f reads %8.1f bytes out %7.1f bytes in "
+          "%8.3f ms usb %8.3f ms cpu" %
+          (name, d.writes / n, d.reads / n, d.bytes_out / n, d.bytes_in / n,
+           d.usb_time / n * 1e3, elapsed / n * 1e3))
+
+def main():
+    d = MockMPSSE()
+    tuss = TUSS4470(d)
+
+    bench("default_setup", d, tuss.default_setup)
+    bench("read_register", d, lambda: tuss.read_register(TUSS_REG_DEVICE_ID))
+    bench("refresh_registers", d, tuss.refresh_registers)
+    bench("set_threshold", d, lambda: (tuss.set_threshold(0x3),
+                                       tuss.set_threshold(0x7)))
+    bench("set_threshold (same)", d, lambda: tuss.set_threshold(0x7))
+    bench("burst", d, tuss.burst)
+    bench("ranging (10 cycles)", d, lambda: tuss.ranging(10), n=10)
+
+    cycles_info = tuss.ranging(100)
+    tuss_ranging_stats(cycles_info)
+    tof = cycles_info[-1][2]
+    print("echo at %.3f ms, expected %.3f ms" %
+          (tof * 1e3, d.tuss.echo_s * 1e3))
+
+    # Echo is seen by the first sample after it arrives
+    if not 0 <= tof - d.tuss.echo_s < tuss_sample_period(100000):
+        print("Error: wrong time of flight")
+        return 1
+
+    return 0 if not tuss.verify_registers() else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
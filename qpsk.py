@@ -2,28 +2,24 @@
 
 import commpy
 import scipy
+import dft
+import modem
 import numpy as np
 import matplotlib.pyplot as plt
 
 
+# Works on a single time instant and on whole time vectors alike
 def signal(t):
     Fcarrier = 30
     Fsymbols = 10
 
     symbols = (1,1,1, -1, 1,1, -1,-1, 1,1, -1)
 
-    cos = np.cos(2*np.pi*t*Fcarrier)
-    symbol = symbols[int(t*Fsymbols) % len(symbols)]
+    return modem.bpsk_modulate(t, symbols, Fsymbols, Fcarrier)# + np.random.randn() * np.sqrt(0.1)
 
-    return cos * symbol, symbol# + np.random.randn() * np.sqrt(0.1)
-
-# Slow fourier transform :)
-def sft(sig):
-    n = len(sig)
-    zeta = np.exp(-2 * np.pi * 1j / n)
-    freq = np.array([np.array([sig[i] * zeta**(i * f) for i in range(0, n)]).sum()
-            for f in range(0, n)])
-    return freq
+# Not so slow fourier transform anymore, see dft.py
+def sft(sig, bins=None, band=None, m=None, fs=1):
+    return dft.dft(sig, bins, band, m, fs)
 
 def cos(f, Fs):
     t = np.linspace(0, 1, int(Fs), endpoint=False)
@@ -34,68 +30,47 @@ def sin(f, Fs):
     return np.sin(2*np.pi*f*t)
 
 def freq_shift(freq_arr, shift_freq, Fs):
-    nyquist = int(Fs) // 2
-    out_arr = []
-    for freq in freq_arr:
-        shifted = freq - shift_freq
-        if (shifted // nyquist) & 1:
-            shifted = -shifted % nyquist
-        else:
-            shifted = shifted % nyquist
-        out_arr.append(shifted)
-        out_arr.append(shifted * -1)
-
-        shifted = freq + shift_freq
-        if (shifted // nyquist) & 1:
-            shifted = -shifted % nyquist
-        else:
-            shifted = shifted % nyquist
-        out_arr.append(shifted)
-        out_arr.append(shifted * -1)
+    diff, summ = modem.alias_matrix(freq_arr, [shift_freq], Fs)
+    shifted = np.concatenate((diff, summ), axis=None)
 
     # Unique and sorted
-    return sorted(set(out_arr))
-
-def fft(sig, Fs, plot=False, threshold=0.1):
-    fft = np.fft.fftshift(np.fft.fft(sig))
-    N = len(sig)
-    # Why 1/N scale? See the 3.4 DFT MAGNITUDES, Richard Lyons
-    magnitude = abs(fft) / N
-    # In power dB
-    power_db = 20 * np.log10(magnitude)
-    freq = np.fft.fftshift(np.fft.fftfreq(N, d=1/Fs))
+    return np.unique(np.concatenate((shifted, -shifted))).tolist()
+
+# Spectral peaks above threshold as structured array of
+# (freq, magnitude, dB, phase), see dft.peaks()
+def fft(sig, Fs, plot=False, threshold=0.1, top=None, window=None):
     if plot:
+        N = len(sig)
+        # Why 1/N scale? See the 3.4 DFT MAGNITUDES, Richard Lyons
+        magnitude = abs(np.fft.fftshift(np.fft.fft(sig))) / N
+        freq = np.fft.fftshift(np.fft.fftfreq(N, d=1/Fs))
         t = np.linspace(0, 1, Fs, endpoint=False)
         plt.subplot(211)
         plt.plot(t, sig)
         plt.subplot(212)
         plt.plot(freq, magnitude)
         plt.show()
-    ind = np.argwhere(magnitude > threshold).flatten()
-    return ["%.2f Hz(%.2f dB, %.2f)" % (freq[i], power_db[i], magnitude[i]) for i in ind]
+    return dft.peaks(sig, Fs, threshold, top, window)
 
 # 1,-1, ... sequence; so Fs / 2
 def cos_Fsamp_div_2(Fs):
-    return np.power(-1, np.arange(int(Fs)))
+    return modem.NCO(Fs / 2, Fs).lo(int(Fs)).real
 
 # -1,1, ... sequence; so Fs / 2
 def neg_cos_Fsamp_div_2(Fs):
-    return np.power(-1, np.arange(1, int(Fs) + 1))
+    return modem.NCO(Fs / 2, Fs, phase=np.pi).lo(int(Fs)).real
 
 # 1,0,-1,0 ... sequence; so Fs / 4
 def cos_Fsamp_div_4(Fs):
-    half_Fs = int(Fs) // 2
-    return np.ravel((cos_Fsamp_div_2(half_Fs), np.zeros(half_Fs)), order='F')
+    return modem.NCO(Fs / 4, Fs).lo(int(Fs) // 2 * 2).real
 
 # 0,1,0,-1 ... sequence; so Fs / 4
 def sin_Fsamp_div_4(Fs):
-    half_Fs = int(Fs) // 2
-    return np.ravel((np.zeros(half_Fs), cos_Fsamp_div_2(half_Fs)), order='F')
+    return modem.NCO(Fs / 4, Fs).lo(int(Fs) // 2 * 2).imag
 
 # 0,-1,0,1 ... sequence; so Fs / 4
 def neg_sin_Fsamp_div_4(Fs):
-    half_Fs = int(Fs) // 2
-    return np.ravel((np.zeros(half_Fs), neg_cos_Fsamp_div_2(half_Fs)), order='F')
+    return modem.NCO(-Fs / 4, Fs).lo(int(Fs) // 2 * 2).imag
 
 
 
@@ -103,12 +78,7 @@ N_per_sec = 1000
 N = 1000
 time = np.arange(N)/ N_per_sec
 
-sig = []
-symb = []
-for t in time:
-    si, sy = signal(t)
-    sig.append(si)
-    symb.append(sy)
+sig, symb = signal(time)
 
 
 ####
@@ -174,9 +144,7 @@ num_symbols = 1000
 
 # Generate symbols
 x_int = np.random.randint(0, 4, num_symbols) # 0 to 3
-x_degrees = x_int*360/4.0 + 45 # 45, 135, 225, 315 degrees
-x_radians = x_degrees*np.pi/180.0 # sin() and cos() takes in radians
-x_symbols = np.cos(x_radians) + 1j*np.sin(x_radians) # this produces our QPSK complex symbols
+x_symbols = modem.qpsk_symbols(x_int) # this produces our QPSK complex symbols
 
 # Add phase noise
 phase_noise = np.random.randn(len(x_symbols)) * 0.1 # adjust multiplier for "strength" of phase noise
@@ -187,21 +155,22 @@ n = (np.random.randn(num_symbols) + 1j*np.random.randn(num_symbols))/np.sqrt(2)
 noise_power = 0.01
 #x_symbols = x_symbols + n * np.sqrt(noise_power)
 
-x = np.zeros(samples_per_symbol*num_symbols, dtype='complex')
-x[::samples_per_symbol] = x_symbols  # insert symbols every sample per symbol
-t_x = np.arange(len(x))/Fs
+t_x = np.arange(samples_per_symbol*num_symbols)/Fs
 
-# Shape pulses
+# Shape pulses at the symbol rate, no zero stuffing
 rrc, t_rrc, t0 = get_pulse_shaping_kernel(Fs, Ts)
-u = np.convolve(x, rrc)
+shaper = modem.PolyphaseInterpolator(rrc, samples_per_symbol)
+u = np.concatenate((shaper.process(x_symbols), shaper.flush()))
 t_u = np.arange(len(u))/Fs
 
-i = u.real
-q = u.imag
+# Matched filter, sampled once per symbol after both filter delays
+matched = modem.PolyphaseDecimator(rrc, samples_per_symbol,
+                                   phase=2*np.argmax(rrc))
+y_symbols = matched.process(u)[:num_symbols]
 
-iup = i * np.cos(2*np.pi*t_u*Fc)
-qup = q * -np.sin(2*np.pi*t_u*Fc)
-s = iup + qup
+# i * cos() - q * sin(), phase is kept if fed block by block
+mixer = modem.Mixer(Fc, Fs)
+s = mixer.upconvert(u)
 
 #plt.plot(x_symbols.real, x_symbols.imag, '.')
 #plt.plot(t[:70], np.real(x)[:70], '-x')
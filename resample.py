@@ -0,0 +1,376 @@
+#!/usr/bin/python3
+
+#
+# Resampling by interpolation at fractional sample positions.
+#
+# Every kernel is written in Farrow form: a matrix C maps the window of
+# input samples around floor(pos) to the coefficients of a polynomial in
+# mu = pos - floor(pos), evaluated by Horner's rule. The branch filters
+# (rows of C) run at the input rate and every output only gathers its
+# coefficients, so whole arrays go through a few vector operations:
+#
+#   linear     - 2 points, lin_interp()
+#   cosine     - 2 points, linear with mu warped by a raised cosine
+#   cubic      - 4 points, cubic_interp()
+#   lagrange   - 4 points, 3rd order Lagrange fractional delay
+#
+# Positions outside the signal repeat the edge samples. Resampler does
+# the same on streamed blocks, keeping the history samples the kernel
+# needs, and gives the output of resample() on the whole signal.
+#
+# For sample rate conversion by a rational up/down ratio, where the
+# interpolating kernels alias, RationalResampler is a polyphase
+# converter with the anti-aliasing filter of scipy.signal.resample_poly().
+# The filter comes from the fir.firwin_bank() cache and is split into
+# its up phases once per ratio. Every phase is one matrix product over
+# strided windows of the input (blocks too short for that gather a window
+# per output), the history is carried between blocks.
+#
+# Running this file benchmarks against the former loop of interp.py and
+# scipy.signal.resample_poly().
+#
+
+import functools, math, sys, time, tracemalloc
+import numpy as np
+import fir
+
+def lin_interp(y1, y2, mu):
+    return y1*(1-mu)+y2*mu
+
+def cos_interp(y1, y2, mu):
+   mu2 = (1 - np.cos(mu*np.pi))/2
+   return y1*(1-mu2)+y2*mu2
+
+def cubic_interp(y0, y1, y2, y3, mu):
+   mu2 = mu*mu
+   a0 = y3 - y2 - y0 + y1
+   a1 = y0 - y1 - a0
+   a2 = y2 - y0
+   a3 = y1
+   return a0*mu*mu2+a1*mu2+a2*mu+a3
+
+# Kernel name: (offset of the first window sample from floor(pos),
+# Farrow matrix with one row per power of mu, lowest first)
+KERNELS = {
+    "linear": (0, np.array([[1., 0.],
+                            [-1., 1.]])),
+    "cosine": (0, np.array([[1., 0.],
+                            [-1., 1.]])),
+    "cubic": (-1, np.array([[0., 1., 0., 0.],
+                            [-1., 0., 1., 0.],
+                            [2., -2., 1., -1.],
+                            [-1., 1., -1., 1.]])),
+    "lagrange": (-1, np.array([[0., 1., 0., 0.],
+                               [-1/3, -1/2, 1., -1/6],
+                               [1/2, -1., 1/2, 0.],
+                               [-1/6, 1/2, -1/2, 1/6]])),
+}
+
+# Output positions evaluated at once by interp()
+RESAMPLE_CHUNK = 2**14
+
+# Outputs per phase below which RationalResampler gathers per output
+POLYPHASE_MIN_ROWS = 16
+
+# Samples the kernel needs before and after floor(pos)
+def kernel_span(kernel):
+    offset, C = KERNELS[kernel]
+    return -offset, C.shape[1] - 1 + offset
+
+# x at fractional positions pos, without clipping: every window has to
+# lie inside x. floor(pos) + base indexes x, base is kept apart from pos
+# so that mu does not depend on it. The branch filters (rows of C) run
+# at the input rate over the windows in use, each output only gathers
+# its coefficients and evaluates the polynomial
+def farrow(x, pos, kernel="cubic", base=0):
+    offset, C = KERNELS[kernel]
+    i = np.floor(pos)
+    mu = pos - i
+    if kernel == "cosine":
+        mu = (1 - np.cos(mu*np.pi))/2
+    if len(pos) == 0:
+        return np.empty(x.shape[:-1] + (0,), dtype=np.result_type(x, mu))
+
+    i = i.astype(np.intp) + (base + offset)
+    lo, hi = i.min(), i.max() + 1
+    # Elementwise rather than a matmul, whose summation order depends on
+    # the number of rows, so blocks give the same bits as whole arrays
+    branches = x[..., None, lo:hi] * C[:, :1]
+    for j in range(1, C.shape[1]):
+        branches += x[..., None, lo+j:hi+j] * C[:, j:j+1]
+
+    coeffs = np.take(branches, i - lo, axis=-1)
+    out = coeffs[..., -1, :]
+    for k in range(C.shape[0] - 2, -1, -1):
+        out = out * mu + coeffs[..., k, :]
+    return out
+
+# x (..., samples) at fractional sample positions pos, edges repeated
+def interp(x, pos, kernel="cubic"):
+    x = np.asarray(x)
+    pos = np.clip(np.asarray(pos, dtype=float), 0, x.shape[-1] - 1)
+    before, after = kernel_span(kernel)
+    x = np.pad(x, [(0, 0)] * (x.ndim - 1) + [(before, after)], mode="edge")
+
+    # In chunks, so that the gathered coefficients stay in cache
+    out = np.empty(x.shape[:-1] + pos.shape, dtype=np.result_type(x, pos))
+    for i in range(0, len(pos), RESAMPLE_CHUNK):
+        chunk = slice(i, i + RESAMPLE_CHUNK)
+        out[..., chunk] = farrow(x, pos[chunk], kernel, before)
+    return out
+
+# ratio output samples per input sample, first to last input sample
+def resample(x, ratio, kernel="cubic"):
+    x = np.asarray(x)
+    n = int(np.floor((x.shape[-1] - 1) * ratio)) + 1
+    return interp(x, np.arange(n) / ratio, kernel)
+
+# x delayed by a (possibly per-sample) fractional delay in samples
+def fractional_delay(x, delay, kernel="lagrange"):
+    x = np.asarray(x)
+    return interp(x, np.arange(x.shape[-1]) - delay, kernel)
+
+class Resampler:
+    def __init__(self, ratio, kernel="cubic"):
+        self.ratio = ratio
+        self.kernel = kernel
+        self.before, self.after = kernel_span(kernel)
+        self.reset()
+
+    def reset(self):
+        self.hist = None
+        # Outputs so far and input samples dropped from the history
+        self.nout = 0
+        self.dropped = -self.before
+
+    def process(self, x):
+        x = np.asarray(x)
+        if self.hist is None:
+            # Left edge is repeated like in interp()
+            self.hist = np.repeat(x[..., :1], self.before, axis=-1)
+        buf = np.concatenate((self.hist, x), axis=-1)
+
+        # Output positions whose window is complete, relative to buf.
+        # Global position minus an integer is exact, so the positions
+        # are the same as resample() computes
+        last = buf.shape[-1] - 1 - self.after + self.dropped
+        n = max(0, int(np.floor(last * self.ratio)) + 1 - self.nout)
+        pos = np.arange(self.nout, self.nout + n) / self.ratio
+        while n and pos[-1] > last:
+            n -= 1
+            pos = pos[:n]
+        out = farrow(buf, pos, self.kernel, -self.dropped)
+        self.nout += n
+
+        # Keep the window of the next output
+        keep = int(np.floor(self.nout / self.ratio)) - self.dropped - \
+               self.before
+        keep = min(max(keep, 0), buf.shape[-1])
+        self.hist = buf[..., keep:]
+        self.dropped += keep
+        return out
+
+    # Outputs up to the last input sample, the right edge repeated
+    def flush(self):
+        if self.hist is None:
+            return np.empty(0)
+        pad = np.repeat(self.hist[..., -1:], self.after, axis=-1)
+        return self.process(pad)
+
+# Anti-aliasing lowpass of resample_poly() split into phases: row p of
+# the (up, taps) matrix holds h[p::up] reversed, to be applied to input
+# windows in ascending order. half_len is the delay of the filter in
+# upsampled samples
+@functools.lru_cache
+def polyphase_plan(up, down, window=("kaiser", 5.0)):
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    h = fir.firwin_bank(2 * half_len + 1, [(0, 1 / max_rate)], fs=2,
+                        window=window)[0] * up
+
+    ntaps = -(-len(h) // up)
+    h = np.pad(h, (0, ntaps * up - len(h)))
+    return h.reshape(ntaps, up).T[:, ::-1].copy(), half_len
+
+class RationalResampler:
+    def __init__(self, up, down, window=("kaiser", 5.0)):
+        g = math.gcd(up, down)
+        self.up, self.down = up // g, down // g
+        self.H, self.half_len = polyphase_plan(self.up, self.down, window)
+        self.ntaps = self.H.shape[1]
+        self.reset()
+
+    def reset(self):
+        self.hist = None
+        # Input starts with zeros, like resample_poly() pads it
+        self.dropped = 1 - self.ntaps
+        self.nin = 0
+        self.nout = 0
+        self.limit = None
+
+    # Input sample the last tap of output k sits on
+    def center(self, k):
+        return (k * self.down + self.half_len) // self.up
+
+    # With final set, x is the last block and the remaining
+    # ceil(nin * up / down) outputs are produced, input padded with zeros
+    def process(self, x, final=False):
+        x = np.asarray(x)
+        if self.hist is None:
+            self.hist = np.zeros(x.shape[:-1] + (self.ntaps - 1,),
+                                 dtype=np.result_type(x, self.H))
+        self.nin += x.shape[-1]
+
+        pad = 0
+        if final:
+            self.limit = -(-self.nin * self.up // self.down)
+            pad = max(0, self.center(self.limit - 1) + 1 - self.dropped -
+                      self.hist.shape[-1] - x.shape[-1])
+        buf = np.concatenate((self.hist, x, np.zeros(
+            x.shape[:-1] + (pad,), dtype=self.hist.dtype)), axis=-1)
+
+        # Outputs whose last input is in buf
+        avail = self.dropped + buf.shape[-1]
+        end = (avail * self.up - 1 - self.half_len) // self.down + 1
+        if self.limit is not None:
+            end = min(end, self.limit)
+        n = max(0, end - self.nout)
+
+        out = np.empty(buf.shape[:-1] + (n,), dtype=buf.dtype)
+        if n:
+            win = np.lib.stride_tricks.sliding_window_view(buf, self.ntaps,
+                                                            axis=-1)
+        if n < POLYPHASE_MIN_ROWS * self.up:
+            # Too few outputs per phase for a product per phase, every
+            # output gathers its window and its phase instead
+            t = np.arange(self.nout, self.nout + n) * self.down + \
+                self.half_len
+            start = t // self.up - self.ntaps + 1 - self.dropped
+            for i in range(0, n, RESAMPLE_CHUNK):
+                chunk = slice(i, i + RESAMPLE_CHUNK)
+                rows = win[..., start[chunk], None, :]
+                out[..., chunk] = (rows @ self.H[t[chunk] % self.up,
+                                                 :, None])[..., 0, 0]
+        else:
+            # Outputs up apart share a phase and are down inputs apart
+            for r in range(self.up):
+                k = self.nout + r
+                p = (k * self.down + self.half_len) % self.up
+                start = self.center(k) - self.ntaps + 1 - self.dropped
+                count = len(range(r, n, self.up))
+                rows = win[..., start:start + (count - 1) * self.down + 1:
+                           self.down, :]
+                out[..., r::self.up] = rows @ self.H[p]
+        self.nout += n
+
+        # Keep the windows of the next outputs
+        keep = self.center(self.nout) - self.ntaps + 1 - self.dropped
+        keep = min(max(keep, 0), buf.shape[-1])
+        self.hist = buf[..., keep:]
+        self.dropped += keep
+        return out
+
+    def flush(self):
+        if self.hist is None:
+            return np.empty(0)
+        return self.process(self.hist[..., :0], final=True)
+
+# x (..., samples) resampled by up / down, same output as
+# scipy.signal.resample_poly() with its default constant padding
+def resample_poly(x, up, down, window=("kaiser", 5.0)):
+    return RationalResampler(up, down, window).process(x, final=True)
+
+# The former interp.py loop, kept as a reference for the benchmark
+def resample_slow(y, n):
+    out = np.array([])
+    for i_seg in range(0, len(y) - 1):
+        p0 = y[i_seg]
+        p1 = y[i_seg + 1]
+        out = np.append(out, p0)
+        for i_p in range(0, n - 1):
+            mu = 1 / n * (i_p + 1)
+            out = np.append(out, cos_interp(p0, p1, mu))
+    return np.append(out, y[-1])
+
+def bench(name, fn, ref, repeat=3):
+    start = time.perf_counter()
+    for i in range(repeat):
+        out = fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print("%-30s %9.2f ms   max err %.2e" %
+          (name, elapsed * 1e3, np.max(np.abs(out - ref))))
+
+def stream(x, ratio, kernel="cubic", block=2**16):
+    r = Resampler(ratio, kernel)
+    return np.concatenate([r.process(x[..., i:i+block])
+                           for i in range(0, x.shape[-1], block)] +
+                          [r.flush()], axis=-1)
+
+# Throughput in input samples per second and peak memory
+def bench_rate(name, fn, ref, nin, repeat=3):
+    start = time.perf_counter()
+    for i in range(repeat):
+        out = fn()
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("%-30s %9.2f ms %8.1f MS/s %8.1f MB" %
+          (name, elapsed * 1e3, nin / elapsed / 1e6, peak / 2**20) +
+          ("" if ref is None else
+           "   max err %.2e" % np.max(np.abs(out - ref))))
+
+# Streamed blocks, kept and joined or dropped like a consumer that
+# writes them out would
+def stream_poly(x, up, down, block=2**16, keep=True):
+    r = RationalResampler(up, down)
+    out = []
+    for i in range(0, x.shape[-1], block):
+        y = r.process(x[..., i:i+block])
+        if keep:
+            out.append(y)
+    out.append(r.flush())
+    return np.concatenate(out, axis=-1)
+
+def main():
+    rng = np.random.default_rng(0)
+    for n in (2000, 2**20):
+        x = rng.standard_normal(n)
+        print("%d samples, 5x upsampling" % n)
+        ref = resample(x, 5, "cosine")
+        if n <= 2000:
+            bench("interp.py loop", lambda: resample_slow(x, 5), ref, 1)
+        for kernel in KERNELS:
+            bench("resample (%s)" % kernel,
+                  lambda: resample(x, 5, kernel), resample(x, 5, kernel))
+        bench("Resampler (cubic, 64K blocks)", lambda: stream(x, 5),
+              resample(x, 5))
+
+    from scipy import signal
+
+    x = rng.standard_normal(2**20)
+    for up, down, name in ((160, 147, "44.1 -> 48 kHz"),
+                           (147, 160, "48 -> 44.1 kHz"),
+                           (4000, 441, "44.1 -> 400 kHz"),
+                           (441, 4000, "400 -> 44.1 kHz")):
+        print("%d samples, %d/%d, %s" % (len(x), up, down, name))
+        ref = signal.resample_poly(x, up, down)
+        bench_rate("scipy resample_poly", lambda:
+                   signal.resample_poly(x, up, down), ref, len(x))
+        bench_rate("resample_poly", lambda: resample_poly(x, up, down),
+                   ref, len(x))
+        bench_rate("RationalResampler, 64K blocks", lambda:
+                   stream_poly(x, up, down), ref, len(x))
+        bench_rate("  outputs dropped", lambda:
+                   stream_poly(x, up, down, keep=False), None, len(x))
+        xs = np.stack((x, -x))
+        bench_rate("resample_poly, 2 channels", lambda:
+                   resample_poly(xs, up, down), np.stack((ref, -ref)),
+                   xs.size)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,15 @@
 
 ### https://www.frank-zalkow.de/en/create-audio-spectrograms-with-python.html
 
+import argparse
+import functools
+import glob
+import multiprocessing
+import os
+import sys
+import time
 import numpy as np
+import matplotlib
 from matplotlib import pyplot as plt
 import scipy.io.wavfile as wav
 from numpy.lib import stride_tricks
@@ -31,32 +39,88 @@ def stft(sig, frameSize, overlapFac=0.5, window=np.hanning):
 
     return rfft
 
-""" scale frequency axis logarithmically """    
-def logscale_spec(spec, sr=44100, factor=20.):
-    timebins, freqbins = np.shape(spec)
+""" streaming short time fourier transform: consumes an iterable of sample
+    blocks and yields rfft frames in batches of at most batchSize rows.
+    Concatenated batches are equal to stft() output, but only a buffer of
+    (batchSize - 1) * hopSize + frameSize samples is ever held """
+def stft_iter(blocks, frameSize, overlapFac=0.5, window=np.hanning,
+              batchSize=256):
+    win = window(frameSize)
+    hopSize = int(frameSize - np.floor(overlapFac * frameSize))
+    front = int(np.floor(frameSize/2.0))
+
+    # samples covered by one full batch of frames
+    span = (batchSize - 1) * hopSize + frameSize
+    # frameSize - hopSize samples are carried over to the next batch
+    carry = span - batchSize * hopSize
+    buf = np.zeros(span)
+    stride = buf.strides[0]
+
+    def batch(n):
+        frames = stride_tricks.as_strided(buf, shape=(n, frameSize),
+                                          strides=(stride*hopSize, stride))
+        return np.fft.rfft(frames * win)
+
+    # zeros at beginning are already there
+    fill = front
+    nsamples = 0
+    ncols = 0
+    for block in blocks:
+        block = np.asarray(block)
+        nsamples += len(block)
+        pos = 0
+        while pos < len(block):
+            n = min(span - fill, len(block) - pos)
+            buf[fill:fill+n] = block[pos:pos+n]
+            fill += n
+            pos += n
+            if fill == span:
+                yield batch(batchSize)
+                ncols += batchSize
+                buf[:carry] = buf[span-carry:span]
+                fill = carry
+
+    # cols for windowing, same as stft() computes for the whole signal
+    cols = int(np.ceil( (front + nsamples - frameSize) / float(hopSize)) + 1)
+    if cols > ncols:
+        # zeros at end
+        buf[fill:] = 0
+        yield batch(cols - ncols)
+
+""" read wav file lazily (memory mapped) and split it into sample blocks """
+def wav_blocks(audiopath, blockSize=2**16):
+    samplerate, samples = wav.read(audiopath, mmap=True)
+    blocks = (samples[i:i+blockSize] for i in range(0, len(samples), blockSize))
+    return samplerate, len(samples), blocks
 
+""" log frequency rebinning operator: first source bin of every new bin and
+    center freq of new bins, computed once per (freqbins, sr, factor) """
+@functools.lru_cache(maxsize=32)
+def logscale_bins(freqbins, sr=44100, factor=20.):
     scale = np.linspace(0, 1, freqbins) ** factor
     scale *= (freqbins-1)/max(scale)
-    scale = np.unique(np.round(scale))
+    scale = np.unique(np.round(scale)).astype(np.intp)
 
-    # create spectrogram with new freq bins
-    newspec = np.complex128(np.zeros([timebins, len(scale)]))
-    for i in range(0, len(scale)):
-        if i == len(scale)-1:
-            newspec[:,i] = np.sum(spec[:,scale[i]:], axis=1)
-        else:        
-            newspec[:,i] = np.sum(spec[:,scale[i]:scale[i+1]], axis=1)
-
-    # list center freq of bins
+    # list center freq of bins, the last bin spans up to nyquist
     allfreqs = np.abs(np.fft.fftfreq(freqbins*2, 1./sr)[:freqbins+1])
-    freqs = []
-    for i in range(0, len(scale)):
-        if i == len(scale)-1:
-            freqs += [np.mean(allfreqs[scale[i]:])]
-        else:
-            freqs += [np.mean(allfreqs[scale[i]:scale[i+1]])]
+    counts = np.diff(np.append(scale, len(allfreqs)))
+    freqs = np.add.reduceat(allfreqs, scale) / counts
+
+    scale.flags.writeable = False
+    freqs.flags.writeable = False
+
+    return scale, freqs
+
+""" scale frequency axis logarithmically """
+def logscale_spec(spec, sr=44100, factor=20.):
+    timebins, freqbins = np.shape(spec)
+    scale, freqs = logscale_bins(freqbins, sr, factor)
+
+    # create spectrogram with new freq bins
+    newspec = np.add.reduceat(np.asarray(spec, dtype=np.complex128), scale,
+                              axis=1)
 
-    return newspec, freqs
+    return newspec, list(freqs)
 
 """ plot spectrogram"""
 def plotstft(audiopath, binsize=2**10, plotpath=None, colormap="jet"):
@@ -91,5 +155,108 @@ def plotstft(audiopath, binsize=2**10, plotpath=None, colormap="jet"):
 
     plt.clf()
 
-#plotstft("tones.wav")
-plotstft("schnitzel.wav")
+""" log scaled spectrogram of a wav file in decibel, computed in batches
+    straight into the preallocated image buffer of shape (timebins, freqbins) """
+def spectrogram_db(audiopath, binsize=2**10, factor=1.0):
+    samplerate, nsamples, blocks = wav_blocks(audiopath)
+    # mix multichannel files down to mono
+    blocks = (b if b.ndim == 1 else b.mean(axis=1) for b in blocks)
+
+    hopSize = int(binsize - np.floor(0.5 * binsize))
+    cols = int(np.ceil( (binsize//2 + nsamples - binsize) / float(hopSize)) + 1)
+    scale, freqs = logscale_bins(binsize//2 + 1, samplerate, factor)
+
+    ims = np.empty((cols, len(scale)), dtype=np.float32)
+    col = 0
+    with np.errstate(divide="ignore"):
+        for s in stft_iter(blocks, binsize):
+            sshow = np.add.reduceat(s, scale, axis=1)
+            # amplitude to decibel
+            ims[col:col+len(s)] = 20.*np.log10(np.abs(sshow)/10e-6)
+            col += len(s)
+
+    return ims, freqs
+
+""" render spectrogram of one file to png (or raw dB array as .npy),
+    returns size of the input in bytes """
+def renderstft(audiopath, outpath, binsize=2**10, colormap="jet"):
+    ims, freqs = spectrogram_db(audiopath, binsize)
+    if outpath.endswith(".npy"):
+        np.save(outpath, ims)
+    else:
+        finite = ims[np.isfinite(ims)]
+        vmin, vmax = (finite.min(), finite.max()) if finite.size else (0, 1)
+        plt.imsave(outpath, np.transpose(ims), origin="lower", cmap=colormap,
+                   vmin=vmin, vmax=vmax)
+
+    return os.path.getsize(audiopath)
+
+def _render_worker(args):
+    return renderstft(*args)
+
+""" expand directories to the wav files they contain """
+def wav_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(glob.glob(os.path.join(path, "*.wav")))
+        else:
+            yield path
+
+""" render spectrograms of many files on a process pool, skipping files
+    whose output is newer than the input """
+def batchstft(paths, outdir=None, ext=".png", binsize=2**10, colormap="jet",
+              jobs=None, force=False):
+    tasks = []
+    for audiopath in wav_paths(paths):
+        base = os.path.splitext(os.path.basename(audiopath))[0] + ext
+        outpath = os.path.join(outdir or os.path.dirname(audiopath), base)
+        if not force and os.path.exists(outpath) and \
+           os.path.getmtime(outpath) >= os.path.getmtime(audiopath):
+            continue
+        tasks.append((audiopath, outpath, binsize, colormap))
+
+    start = time.perf_counter()
+    nbytes = 0
+    if tasks:
+        if outdir:
+            os.makedirs(outdir, exist_ok=True)
+        with multiprocessing.Pool(jobs, initializer=matplotlib.use,
+                                  initargs=("Agg",)) as pool:
+            for n in pool.imap_unordered(_render_worker, tasks):
+                nbytes += n
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    print("%d files (%.2f MB) in %.2f s: %.2f files/s, %.2f MB/s" %
+          (len(tasks), nbytes/1e6, elapsed,
+           len(tasks)/elapsed, nbytes/1e6/elapsed))
+
+    return len(tasks), nbytes
+
+def main():
+    parser = argparse.ArgumentParser(description="Render spectrograms of wav files")
+    parser.add_argument("paths", nargs="+", help="wav files or directories")
+    parser.add_argument("-o", "--outdir", help="output directory, "
+                        "next to the input by default")
+    parser.add_argument("-j", "--jobs", type=int, help="number of processes")
+    parser.add_argument("-b", "--binsize", type=int, default=2**10)
+    parser.add_argument("-c", "--colormap", default="jet")
+    parser.add_argument("--npy", action="store_true",
+                        help="write raw dB arrays instead of png")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="render even if output is up to date")
+    parser.add_argument("--show", action="store_true",
+                        help="plot interactively instead of batch rendering")
+    args = parser.parse_args()
+
+    if args.show:
+        for audiopath in wav_paths(args.paths):
+            plotstft(audiopath, args.binsize, colormap=args.colormap)
+        return 0
+
+    batchstft(args.paths, args.outdir, ".npy" if args.npy else ".png",
+              args.binsize, args.colormap, args.jobs, args.force)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,8 +21,8 @@
 # https://github.com/rouming/FT232H-bluepill/
 #
 
-import time, sys, math
-import pylibftdi as ftdi
+import time, sys, math, collections, asyncio
+from ftdi_async import FTDI_READ_POLL_S
 
 # Modes
 BITMODE_RESET  = 0x00
@@ -47,6 +47,7 @@ GET_BITS_HIGH  = 0x83
 LOOPBACK_START = 0x84
 LOOPBACK_END   = 0x85
 TCK_DIVISOR    = 0x86
+SEND_IMMEDIATE = 0x87
 
 # H Type specific commands
 DIS_DIV_5       = 0x8a
@@ -73,6 +74,8 @@ DI_PIN  = 1<<2
 CS_PIN  = 1<<3
 IO1_PIN = 1<<4
 IO2_PIN = 1<<5
+# TUSS OUT4 (echo interrupt in IO mode 1), sampled while listening
+ECHO_PIN = 1<<6
 
 OUT_PINS = SK_PIN|DO_PIN|CS_PIN|IO1_PIN|IO2_PIN
 
@@ -192,13 +195,42 @@ TUSS_SPI_READ_BIT                    = 0x80
 def ilog2(n):
     return 0 if n < 1 else int(math.log(n, 2))
 
+def ftdi_clock_div(hz):
+    return int((12000000 / (hz * 2)) - 1)
+
+# SK frequency the divisor for hz really gives, the divisor is truncated
+def ftdi_clock_hz(hz):
+    return 12000000 / ((ftdi_clock_div(hz) + 1) * 2)
+
+def ftdi_make_clock(hz):
+    div = ftdi_clock_div(hz)
+    return (TCK_DIVISOR, div%256, div//256)
+
 def ftdi_set_clock(d, hz):
-    div = int((12000000 / (hz * 2)) - 1)
-    ftdi_write(d, (TCK_DIVISOR, div%256, div//256))
+    ftdi_write(d, ftdi_make_clock(hz))
 
 def ftdi_read(d, nbytes):
-    s = d.read(nbytes)
-    return list(s)
+    return d.read(nbytes)
+
+def ftdi_read_exact(d, nbytes, timeout=1.0):
+    # Read may return less (or nothing) without waiting, so accumulate
+    rd = bytearray(ftdi_read(d, nbytes))
+    deadline = time.perf_counter() + timeout
+    while len(rd) < nbytes:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        # Let the device fill its buffer instead of spinning
+        time.sleep(min(FTDI_READ_POLL_S, remaining))
+        rd += ftdi_read(d, nbytes - len(rd))
+
+    return rd
+
+# Read and drop nbytes still owed by an aborted transfer, then clear the
+# RX buffer, so they are not returned to the next one
+def ftdi_purge(d, nbytes, timeout=1.0):
+    ftdi_read_exact(d, nbytes, timeout)
+    d.flush_input()
 
 def ftdi_write(d, data):
     s = bytes(data)
@@ -213,31 +245,37 @@ def ftdi_make_mpsse_pkg(cmd, data):
     hdr = ftdi_make_hdr(cmd, len(data))
     return hdr + tuple(data)
 
+#
+# Parity of the 16 bit SPI word, same as the bit walking loop:
+#
+#    while data_in & 0xFFFE:
+#        parity += data_in & 1
+#        data_in >>= 1
+#
+# which skips the highest set bit, i.e. inverted parity of the whole word
+# for everything except 0.
+#
+TUSS_PARITY_TABLE = bytes(((bin(w).count("1") & 1) ^ 1) if w else 0
+                          for w in range(1 << 16))
+
 def tuss_calc_parity_bit(data_arr):
-    parity = 0
-    data_in = (data_arr[0] << 8) | data_arr[1]
-    while data_in & 0xFFFE:
-        parity += data_in & 1
-        data_in >>= 1
+    return TUSS_PARITY_TABLE[(data_arr[0] << 8) | data_arr[1]]
 
-    return parity & 1
+# Length of the SPI frame command and offset of the first payload byte
+TUSS_SPI_FRAME_LEN = 11
+TUSS_SPI_FRAME_DATA = 6
 
-def tuss_spi_write_read(b1, b2):
+def tuss_spi_make_frame(b1, b2):
     b1 |= tuss_calc_parity_bit([b1, b2])
 
-    ret = ftdi_write(d,
-             # CS low, IO1|IO2 high
-             (SET_BITS_LOW, IO1_PIN|IO2_PIN, OUT_PINS) +
-             # SPI write-read, mode 1
-             ftdi_make_mpsse_pkg(MPSSE_DO_READ | MPSSE_DO_WRITE, [b1, b2]) +
-             # CS|IO1|IO2 high, other low
-             (SET_BITS_LOW, CS_PIN|IO1_PIN|IO2_PIN, OUT_PINS))
-    if ret != 11:
-        return (-1, 0x00)
+    # CS low, IO1|IO2 high
+    return ((SET_BITS_LOW, IO1_PIN|IO2_PIN, OUT_PINS) +
+            # SPI write-read, mode 1
+            ftdi_make_mpsse_pkg(MPSSE_DO_READ | MPSSE_DO_WRITE, [b1, b2]) +
+            # CS|IO1|IO2 high, other low
+            (SET_BITS_LOW, CS_PIN|IO1_PIN|IO2_PIN, OUT_PINS))
 
-    rd = ftdi_read(d, 2)
-    if len(rd) != 2:
-        return (-1, 0x00)
+def tuss_spi_parse_response(rd):
     if rd[0] & 0x80:
         print("Error: parity error set")
         return (-1, 0x00)
@@ -246,79 +284,403 @@ def tuss_spi_write_read(b1, b2):
 
     return (status, rd[1])
 
-def tuss_read_register(reg):
-    b1 = TUSS_SPI_READ_BIT | ((reg & 0x3F) << 1)
-    b2 = 0x00
-
-    return tuss_spi_write_read(b1, b2)
-
-def tuss_write_register(reg, data_in):
-    b1 = (reg & 0x3F) << 1
-    b2 = data_in
-
-    rd = tuss_spi_write_read(b1, b2)
-    if rd[1] != b1:
-        return -1
-
-    return 0
-
-def tuss_default_setup():
-    # Set SPI clock frequency
-    ftdi_set_clock(d, 1e6)
-
-    rd = tuss_read_register(TUSS_REG_DEVICE_ID)
-    if rd[1] != TUSS_DEVICE_ID:
-        print("Unexpected response from device '%x', should be '%x'" %
-              (rd[1], TUSS_DEVICE_ID))
-        return -1
-
-    ret = 0
-    ret |= tuss_write_register(TUSS_REG_BPF_CONFIG_1, TUSS_BPF_CONFIG_1_RESET)
-    ret |= tuss_write_register(TUSS_REG_BPF_CONFIG_2, TUSS_BPF_CONFIG_2_RESET)
-    ret |= tuss_write_register(TUSS_REG_DEV_CTRL_1, TUSS_DEV_CTRL_1_RESET)
-    ret |= tuss_write_register(TUSS_REG_DEV_CTRL_2,
-                               TUSS_DEV_CTRL_2_LOGAMP_DIS_FIRST |
-                               TUSS_DEV_CTRL_2_LOGAMP_DIS_LAST)
-    ret |= tuss_write_register(TUSS_REG_DEV_CTRL_3, TUSS_DEV_CTRL_3_IO_MODE_1)
-    ret |= tuss_write_register(TUSS_REG_VDRV_CTRL,
-                               TUSS_VDRV_CTRL_VDRV_CURR_LVL_20MA |
-                               TUSS_VDRV_CTRL_VDRV_VOLT_LVL_5V)
-    ret |= tuss_write_register(TUSS_REG_ECHO_INT_CONFIG, TUSS_ECHO_INT_CONFIG_RESET)
-    ret |= tuss_write_register(TUSS_REG_ZC_CONFIG, TUSS_ZC_CONFIG_RESET)
-    ret |= tuss_write_register(TUSS_REG_BURST_PULSE, TUSS_BURST_PULSE_BURST_PULSE_16)
-    ret |= tuss_write_register(TUSS_REG_TOF_CONFIG, TUSS_TOF_CONFIG_RESET)
-
-    return ret
-
-def tuss_burst():
+def tuss_read_frame(reg):
+    return (TUSS_SPI_READ_BIT | ((reg & 0x3F) << 1), 0x00)
+
+def tuss_write_frame(reg, data_in):
+    return ((reg & 0x3F) << 1, data_in)
+
+# Configuration registers and their values after reset
+TUSS_CONFIG_REGS_RESET = {
+    TUSS_REG_BPF_CONFIG_1:    TUSS_BPF_CONFIG_1_RESET,
+    TUSS_REG_BPF_CONFIG_2:    TUSS_BPF_CONFIG_2_RESET,
+    TUSS_REG_DEV_CTRL_1:      TUSS_DEV_CTRL_1_RESET,
+    TUSS_REG_DEV_CTRL_2:      TUSS_DEV_CTRL_2_RESET,
+    TUSS_REG_DEV_CTRL_3:      TUSS_DEV_CTRL_3_RESET,
+    TUSS_REG_VDRV_CTRL:       TUSS_VDRV_CTRL_RESET,
+    TUSS_REG_ECHO_INT_CONFIG: TUSS_ECHO_INT_CONFIG_RESET,
+    TUSS_REG_ZC_CONFIG:       TUSS_ZC_CONFIG_RESET,
+    TUSS_REG_BURST_PULSE:     TUSS_BURST_PULSE_RESET,
+    TUSS_REG_TOF_CONFIG:      TUSS_TOF_CONFIG_RESET,
+}
+
+# Configuration written by default_setup()
+TUSS_CONFIG_REGS_DEFAULT = {
+    TUSS_REG_BPF_CONFIG_1:    TUSS_BPF_CONFIG_1_RESET,
+    TUSS_REG_BPF_CONFIG_2:    TUSS_BPF_CONFIG_2_RESET,
+    TUSS_REG_DEV_CTRL_1:      TUSS_DEV_CTRL_1_RESET,
+    TUSS_REG_DEV_CTRL_2:      TUSS_DEV_CTRL_2_LOGAMP_DIS_FIRST |
+                              TUSS_DEV_CTRL_2_LOGAMP_DIS_LAST,
+    TUSS_REG_DEV_CTRL_3:      TUSS_DEV_CTRL_3_IO_MODE_1,
+    TUSS_REG_VDRV_CTRL:       TUSS_VDRV_CTRL_VDRV_CURR_LVL_20MA |
+                              TUSS_VDRV_CTRL_VDRV_VOLT_LVL_5V,
+    TUSS_REG_ECHO_INT_CONFIG: TUSS_ECHO_INT_CONFIG_RESET,
+    TUSS_REG_ZC_CONFIG:       TUSS_ZC_CONFIG_RESET,
+    TUSS_REG_BURST_PULSE:     TUSS_BURST_PULSE_BURST_PULSE_16,
+    TUSS_REG_TOF_CONFIG:      TUSS_TOF_CONFIG_RESET,
+}
+
+def tuss_make_burst_cmd():
     # Set clock for the burst frequency
-    ftdi_set_clock(d, TUSS_BURST_FREQ)
-
-    ret = ftdi_write(d,
-             # Custom command: set IO2 as new clock pin
-             (SET_CLK_PIN, ilog2(IO2_PIN)) +
-             # IO2 high (see recommendation about the IO2 from TI), IO1 low
-             (SET_BITS_LOW, IO2_PIN|CS_PIN, OUT_PINS) +
-             # Number of burst pulses in bytes
-             ftdi_make_hdr(CLK_BYTES, TUSS_BURST_PULSE_BURST_PULSE_16//8) +
-             # CS|IO1|IO2 high, other low
-             (SET_BITS_LOW, CS_PIN|IO1_PIN|IO2_PIN, OUT_PINS) +
-             # Custom command: restore SK as clock pin
-             (SET_CLK_PIN, ilog2(SK_PIN)))
-    if ret != 13:
-        return -1
-
-    return 0
-
-d = ftdi.Device()
-d.ftdi_fn.ftdi_set_bitmode(0, BITMODE_MPSSE)
-
-# CS|IO1 high, other low
-ftdi_write(d, (SET_BITS_LOW, CS_PIN|IO1_PIN, OUT_PINS))
-
-ret = tuss_default_setup()
-print("TUSS setup: %d" % ret)
-
-if ret == 0:
-    ret = tuss_burst()
-    print("TUSS burst: %d" % ret)
+    return (ftdi_make_clock(TUSS_BURST_FREQ) +
+            # Custom command: set IO2 as new clock pin
+            (SET_CLK_PIN, ilog2(IO2_PIN)) +
+            # IO2 high (see recommendation about the IO2 from TI), IO1 low
+            (SET_BITS_LOW, IO2_PIN|CS_PIN, OUT_PINS) +
+            # Number of burst pulses in bytes
+            ftdi_make_hdr(CLK_BYTES, TUSS_BURST_PULSE_BURST_PULSE_16//8) +
+            # CS|IO1|IO2 high, other low
+            (SET_BITS_LOW, CS_PIN|IO1_PIN|IO2_PIN, OUT_PINS) +
+            # Custom command: restore SK as clock pin
+            (SET_CLK_PIN, ilog2(SK_PIN)))
+
+#
+# Continuous ranging: one command buffer per cycle is built once. It
+# contains the burst, a listen window of GPIO samples spaced by 8 idle
+# SK clocks (CS is high, so SPI is not affected) and restores the SPI
+# clock. Several cycles are kept in flight, so the device never waits
+# for the host between cycles.
+#
+def tuss_make_ranging_cmd(listen_s, sample_hz):
+    nsamples = int(listen_s / tuss_sample_period(sample_hz))
+
+    cmd = (tuss_make_burst_cmd() +
+           # 8 clocks per sample
+           ftdi_make_clock(sample_hz * 8) +
+           ((GET_BITS_LOW,) + ftdi_make_hdr(CLK_BYTES, 1)) * nsamples +
+           # Restore SPI clock frequency and flush samples to the host
+           ftdi_make_clock(1e6) +
+           (SEND_IMMEDIATE,))
+
+    return bytes(cmd), nsamples
+
+# Duration of the burst, the listen window starts right after it
+def tuss_burst_s():
+    return TUSS_BURST_PULSE_BURST_PULSE_16 / ftdi_clock_hz(TUSS_BURST_FREQ)
+
+# Real spacing of the listen window samples, 8 SK clocks at the
+# frequency the truncated divisor gives
+def tuss_sample_period(sample_hz):
+    return 8 / ftdi_clock_hz(sample_hz * 8)
+
+# Time of flight from the start of the burst, blank_s is counted from
+# the start of the burst as well
+def tuss_echo_tof(samples, sample_hz, blank_s=0):
+    period = tuss_sample_period(sample_hz)
+    burst_s = tuss_burst_s()
+    first = max(0, math.ceil((blank_s - burst_s) / period))
+    # OUT4 goes low when the echo crosses the threshold
+    for i in range(first, len(samples)):
+        if not samples[i] & ECHO_PIN:
+            return burst_s + i * period
+
+    return None
+
+def tuss_ranging_stats(cycles_info):
+    n = len(cycles_info)
+    if n < 2:
+        return
+
+    lat = sorted(c[1] for c in cycles_info)
+    elapsed = cycles_info[-1][0] - cycles_info[0][0]
+    echoes = sum(1 for c in cycles_info if c[2] is not None)
+
+    print("%d cycles: %.1f pings/s, %d echoes" %
+          (n, (n - 1) / elapsed, echoes))
+    print("latency ms: min %.3f, mean %.3f, p99 %.3f, max %.3f" %
+          (lat[0] * 1e3, sum(lat) / n * 1e3,
+           lat[min(n - 1, int(n * 0.99))] * 1e3, lat[-1] * 1e3))
+
+#
+# TUSS4470 behind an FTDI MPSSE device. Anything with pylibftdi.Device
+# read()/write() semantics works, e.g. the MockMPSSE from mpsse_mock.py.
+#
+class TUSS4470:
+    def __init__(self, d):
+        self.d = d
+        # Register shadow cache: the last values known to be in the
+        # device, so reconfiguration writes only the registers which differ
+        self.shadow = dict(TUSS_CONFIG_REGS_RESET)
+        # SPI command template, grows to the longest transaction
+        self.tx = bytearray()
+
+    #
+    # Queues several SPI frames (CS toggles included) into one MPSSE command
+    # buffer, sends it with one USB write and reads all responses back with
+    # one read, i.e. one USB round trip for the whole transaction.
+    #
+    def spi_transaction(self, frames):
+        n = len(frames)
+        cmd = self.spi_make_cmd(frames)
+        ret = ftdi_write(self.d, cmd)
+        if ret != len(cmd):
+            # Responses of the frames that did go out are unknown
+            ftdi_purge(self.d, 0)
+            return [(-1, 0x00)] * n
+
+        rd = ftdi_read_exact(self.d, 2 * n)
+        if len(rd) != 2 * n:
+            ftdi_purge(self.d, 2 * n - len(rd))
+            return [(-1, 0x00)] * n
+
+        return self.spi_parse_responses(rd)
+
+    # Same over an FtdiAsync transport, which owns the device once started
+    async def spi_transaction_async(self, aio, frames):
+        n = len(frames)
+        try:
+            rd = await aio.transfer(self.spi_make_cmd(frames), 2 * n)
+        except OSError:
+            return [(-1, 0x00)] * n
+
+        return self.spi_parse_responses(rd)
+
+    # MPSSE command buffer of the frames, a view of the template
+    def spi_make_cmd(self, frames):
+        n = len(frames)
+        size = TUSS_SPI_FRAME_LEN * n
+        if len(self.tx) < size:
+            self.tx = bytearray(tuss_spi_make_frame(0x00, 0x00)) * n
+
+        # Only the payload bytes of the command template are patched
+        tx = self.tx
+        off = TUSS_SPI_FRAME_DATA
+        for b1, b2 in frames:
+            tx[off] = b1 | TUSS_PARITY_TABLE[(b1 << 8) | b2]
+            tx[off+1] = b2
+            off += TUSS_SPI_FRAME_LEN
+
+        return memoryview(tx)[:size]
+
+    def spi_parse_responses(self, rd):
+        rd = memoryview(rd)
+        return [tuss_spi_parse_response(rd[i:i+2])
+                for i in range(0, len(rd), 2)]
+
+    def spi_write_read(self, b1, b2):
+        return self.spi_transaction([(b1, b2)])[0]
+
+    def read_register(self, reg):
+        return self.spi_write_read(*tuss_read_frame(reg))
+
+    def read_registers(self, regs):
+        return self.spi_transaction([tuss_read_frame(reg) for reg in regs])
+
+    def write_register(self, reg, data_in):
+        return self.write_registers([(reg, data_in)])
+
+    # Result of every write in the transaction, 0 or -1
+    def write_registers_each(self, regs):
+        frames = [tuss_write_frame(reg, data_in) for reg, data_in in regs]
+        return self.write_results(frames, self.spi_transaction(frames))
+
+    def write_results(self, frames, rds):
+        return [0 if rd[0] >= 0 and rd[1] == b1 else -1
+                for (b1, _), rd in zip(frames, rds)]
+
+    def write_registers(self, regs):
+        return min(self.write_registers_each(regs), default=0)
+
+    def update_registers(self, regs):
+        changed = [(reg, data_in) for reg, data_in in dict(regs).items()
+                   if self.shadow.get(reg) != data_in]
+        if not changed:
+            return 0
+
+        rets = self.write_registers_each(changed)
+        for (reg, data_in), ret in zip(changed, rets):
+            # Unknown state on error, will be written again next time
+            self.shadow[reg] = data_in if ret == 0 else None
+
+        return min(rets)
+
+    def update_field(self, reg, mask, value):
+        if self.shadow.get(reg) is None:
+            # Other fields are unknown, read them back before modifying
+            rd = self.read_register(reg)
+            if rd[0] < 0:
+                return -1
+            self.shadow[reg] = rd[1]
+
+        data_in = self.shadow[reg] & ~mask | (value & mask)
+        return self.update_registers({reg: data_in})
+
+    # update_field() over an FtdiAsync transport
+    async def update_field_async(self, aio, reg, mask, value):
+        if self.shadow.get(reg) is None:
+            rd = await self.spi_transaction_async(aio, [tuss_read_frame(reg)])
+            if rd[0][0] < 0:
+                return -1
+            self.shadow[reg] = rd[0][1]
+
+        data_in = self.shadow[reg] & ~mask | (value & mask)
+        if data_in == self.shadow[reg]:
+            return 0
+
+        frames = [tuss_write_frame(reg, data_in)]
+        ret = self.write_results(
+            frames, await self.spi_transaction_async(aio, frames))[0]
+        self.shadow[reg] = data_in if ret == 0 else None
+        return ret
+
+    def refresh_registers(self):
+        regs = list(TUSS_CONFIG_REGS_RESET)
+        rds = self.read_registers(regs)
+
+        ret = 0
+        for reg, rd in zip(regs, rds):
+            if rd[0] < 0:
+                self.shadow[reg] = None
+                ret = -1
+            else:
+                self.shadow[reg] = rd[1]
+
+        return ret
+
+    def verify_registers(self):
+        regs = list(TUSS_CONFIG_REGS_RESET)
+        rds = self.read_registers(regs)
+
+        mismatch = []
+        for reg, rd in zip(regs, rds):
+            if rd[0] < 0 or rd[1] != self.shadow.get(reg):
+                print("Register '%x' is '%x', expected '%s'" %
+                      (reg, rd[1], self.shadow.get(reg)))
+                mismatch.append(reg)
+
+        return mismatch
+
+    def default_setup(self):
+        # Set SPI clock frequency
+        ftdi_set_clock(self.d, 1e6)
+
+        rd = self.read_register(TUSS_REG_DEVICE_ID)
+        if rd[1] != TUSS_DEVICE_ID:
+            print("Unexpected response from device '%x', should be '%x'" %
+                  (rd[1], TUSS_DEVICE_ID))
+            return -1
+
+        # Device state is unknown, so all registers are written in one
+        # transaction and the shadow is in sync afterwards
+        self.shadow.clear()
+        return self.update_registers(TUSS_CONFIG_REGS_DEFAULT)
+
+    def set_threshold(self, thr):
+        return self.update_field(TUSS_REG_ECHO_INT_CONFIG,
+                                 TUSS_ECHO_INT_CONFIG_THR_SEL_MASK, thr)
+
+    def set_lna_gain(self, gain):
+        return self.update_field(TUSS_REG_DEV_CTRL_2,
+                                 TUSS_DEV_CTRL_2_LNA_GAIN_MASK, gain)
+
+    def burst(self):
+        cmd = tuss_make_burst_cmd()
+        ret = ftdi_write(self.d, cmd)
+        if ret != len(cmd):
+            return -1
+
+        return 0
+
+    def ranging(self, cycles, listen_s=0.003, sample_hz=100000,
+                blank_s=0.0005, depth=2):
+        # Echo comparator drives OUT4
+        if self.update_field(TUSS_REG_ECHO_INT_CONFIG,
+                             TUSS_ECHO_INT_CONFIG_CMP_EN,
+                             TUSS_ECHO_INT_CONFIG_CMP_EN):
+            return None
+
+        cmd, nsamples = tuss_make_ranging_cmd(listen_s, sample_hz)
+
+        # Each entry is (timestamp, latency, time of flight or None)
+        cycles_info = []
+        inflight = collections.deque()
+        submitted = 0
+        while len(cycles_info) < cycles:
+            while submitted < cycles and len(inflight) < depth:
+                if ftdi_write(self.d, cmd) != len(cmd):
+                    ftdi_purge(self.d, len(inflight) * nsamples)
+                    return None
+                inflight.append(time.perf_counter())
+                submitted += 1
+
+            t_submit = inflight.popleft()
+            rd = ftdi_read_exact(self.d, nsamples)
+            t_done = time.perf_counter()
+            if len(rd) != nsamples:
+                # Drop the rest of this cycle and the ones still in flight
+                ftdi_purge(self.d, nsamples - len(rd) +
+                           len(inflight) * nsamples)
+                return None
+
+            cycles_info.append((t_done, t_done - t_submit,
+                                tuss_echo_tof(rd, sample_hz, blank_s)))
+
+        return cycles_info
+
+    #
+    # Same as ranging(), but over an FtdiAsync transport (see ftdi_async.py):
+    # yields (timestamp, latency, time of flight, samples) for every cycle
+    # while the next depth cycles are already submitted to the device.
+    #
+    async def ranging_async(self, aio, cycles, listen_s=0.003,
+                            sample_hz=100000, blank_s=0.0005, depth=2):
+        # Echo comparator drives OUT4, set through the transport since its
+        # I/O thread owns the device
+        if await self.update_field_async(aio, TUSS_REG_ECHO_INT_CONFIG,
+                                         TUSS_ECHO_INT_CONFIG_CMP_EN,
+                                         TUSS_ECHO_INT_CONFIG_CMP_EN):
+            return
+
+        cmd, nsamples = tuss_make_ranging_cmd(listen_s, sample_hz)
+
+        inflight = collections.deque()
+        submitted = 0
+        done = 0
+        while done < cycles:
+            while submitted < cycles and len(inflight) < depth:
+                inflight.append((time.perf_counter(), asyncio.ensure_future(
+                    aio.transfer(cmd, nsamples))))
+                submitted += 1
+
+            t_submit, fut = inflight.popleft()
+            try:
+                rd = await fut
+            except BaseException:
+                for _, f in inflight:
+                    f.cancel()
+                raise
+            t_done = time.perf_counter()
+            done += 1
+
+            yield (t_done, t_done - t_submit,
+                   tuss_echo_tof(rd, sample_hz, blank_s), rd)
+
+def main():
+    import pylibftdi as ftdi
+
+    d = ftdi.Device()
+    d.ftdi_fn.ftdi_set_bitmode(0, BITMODE_MPSSE)
+
+    # CS|IO1 high, other low
+    ftdi_write(d, (SET_BITS_LOW, CS_PIN|IO1_PIN, OUT_PINS))
+
+    tuss = TUSS4470(d)
+    ret = tuss.default_setup()
+    print("TUSS setup: %d" % ret)
+
+    if ret == 0 and len(sys.argv) > 1:
+        # Continuous ranging, number of cycles is given
+        cycles_info = tuss.ranging(int(sys.argv[1]))
+        if cycles_info is None:
+            print("TUSS ranging: -1")
+            ret = -1
+        else:
+            tuss_ranging_stats(cycles_info)
+    elif ret == 0:
+        ret = tuss.burst()
+        print("TUSS burst: %d" % ret)
+
+    return 0 if ret == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())